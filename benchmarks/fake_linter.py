@@ -0,0 +1,46 @@
+"""A deterministic stand-in for a linter, for benchmarking lintmon.
+
+    python benchmarks/fake_linter.py [--seconds S] [--seconds-per-file S] [--noise-lines N] FILE...
+
+Reports a flake8 style problem for every line of each file containing `problem`, so the output
+depends only on the files' content, and sleeps for a fixed time plus a time per file. Noise lines,
+which aren't about any file, can be added to increase the volume of output.
+"""
+import argparse
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=0)
+    parser.add_argument('--seconds-per-file', type=float, default=0)
+    parser.add_argument('--noise-lines', type=int, default=0, help='per file')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    time.sleep(args.seconds + args.seconds_per_file * len(args.files))
+
+    found = False
+    out = sys.stdout
+    for file in args.files:
+        try:
+            with open(file, encoding='utf8', errors='replace') as stream:
+                lines = stream.readlines()
+        except OSError as exc:
+            print(f'{file}:0:0: E902 {exc.strerror}', file=out)
+            found = True
+            continue
+
+        for line_number, line in enumerate(lines, 1):
+            if 'problem' in line:
+                print(f'{file}:{line_number}:1: W001 {line.strip()}', file=out)
+                found = True
+        for noise_number in range(args.noise_lines):
+            print(f'noise {noise_number} while checking', file=out)
+
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
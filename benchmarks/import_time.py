@@ -0,0 +1,62 @@
+"""Check that lintmon-status-prompt's entry point stays cheap to import.
+
+Runs ``python -X importtime -c 'import lintmon.prompt'`` a few times and fails if the best
+cumulative import time of lintmon.prompt exceeds the budget, or if any module that the prompt's
+common path is supposed to avoid has been pulled in.
+
+    python benchmarks/import_time.py [--budget-ms N]
+"""
+import argparse
+import subprocess
+import sys
+
+PROMPT_MODULE = 'lintmon.prompt'
+PROMPT_IMPORT_BUDGET_MS = 15
+RUNS = 5
+FORBIDDEN_MODULES = {'logging', 'psutil', 'subprocess', 'tempfile', 'typing', 'yaml'}
+
+
+def import_times(module):
+    """Return {module name: cumulative import microseconds} for one fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        encoding='utf8',
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.partition('import time:')[2].split('|')
+        if not cumulative.strip().isdigit():
+            # the header line
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=PROMPT_IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    runs = [import_times(PROMPT_MODULE) for _ in range(RUNS)]
+    best_ms = min(times[PROMPT_MODULE] for times in runs) / 1000
+    forbidden = sorted(FORBIDDEN_MODULES.intersection(runs[0]))
+
+    print(f'{PROMPT_MODULE}: {best_ms:.1f}ms (budget {args.budget_ms}ms)')
+    failed = False
+    if best_ms > args.budget_ms:
+        print(f'Over budget by {best_ms - args.budget_ms:.1f}ms')
+        failed = True
+    if forbidden:
+        print(f'Imports modules the prompt should not need: {", ".join(forbidden)}')
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Compare routing files to monitors with FileRouter against filtering per monitor.
+
+    python benchmarks/routing.py [--files N]
+
+Routes a synthetic list of paths to a set of monitors resembling a large project's, once with
+one includes_file filter per monitor (how files were routed before FileRouter) and once with
+FileRouter, both with and without its per-path memo warmed up.
+"""
+import argparse
+import os
+import random
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from lintmon.config import MonitorConfig  # noqa: E402
+from lintmon.routing import FileRouter  # noqa: E402
+from lintmon.utils import lf  # noqa: E402
+
+FILE_PATTERNS = [
+    r'.*\.py$',
+    r'.*\.py$',
+    r'.*\.pyi?$',
+    r'.*\.(js|jsx)$',
+    r'.*\.ts$',
+    r'.*\.tsx$',
+    r'.*\.css$',
+    r'.*\.scss$',
+    r'.*\.(yaml|yml)$',
+    r'.*\.json$',
+    r'.*\.md$',
+    r'.*\.sh$',
+    r'^Dockerfile',
+    r'^test_.*\.py$',
+    None,
+]
+EXTENSIONS = ['py', 'js', 'ts', 'tsx', 'css', 'json', 'md', 'txt', 'png', 'yaml', 'html', 'go']
+
+
+def synthetic_paths(num_files):
+    rng = random.Random(0)
+    return [
+        os.path.join(
+            *(f'dir{rng.randrange(30)}' for _ in range(rng.randrange(1, 6))),
+            f'{rng.choice(["test_", "", ""])}file{i}.{rng.choice(EXTENSIONS)}',
+        )
+        for i in range(num_files)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=60000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    monitors = [
+        MonitorConfig(f'monitor{i}', command=['true'], file_pattern=pattern)
+        for i, pattern in enumerate(FILE_PATTERNS)
+    ]
+    paths = synthetic_paths(args.files)
+
+    def per_monitor():
+        return {mc.name: lf(mc.includes_file, paths) for mc in monitors}
+
+    def router_cold():
+        return FileRouter(monitors).files_by_monitor(paths)
+
+    warm_router = FileRouter(monitors)
+    warm_router.files_by_monitor(paths)
+
+    def router_warm():
+        return warm_router.files_by_monitor(paths)
+
+    assert per_monitor() == router_cold() == router_warm()
+
+    print(f'{len(paths)} files, {len(monitors)} monitors')
+    for name, func in [
+        ('per-monitor filter', per_monitor),
+        ('FileRouter (cold)', router_cold),
+        ('FileRouter (memoised)', router_warm),
+    ]:
+        seconds = timeit(func, number=args.repeat) / args.repeat
+        print(f'  {name:<24}{seconds * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""Benchmark lintmon end to end on a synthetic repository checked by fake linters.
+
+    python benchmarks/suite.py [--files N] [--monitors N] [--output FILE] [--baseline FILE]
+
+Generates a repository of Python files in a temporary directory, with monitors running
+benchmarks/fake_linter.py, and measures:
+
+    run_all_files_per_second   lintmon-run-all --full throughput
+    status_prompt_ms           lintmon-status-prompt's latency (median) while lintmond is running
+    event_to_badge_ms          from writing a file until every monitor has saved its results
+                               (median), through lintmond's watcher, debounce and workers
+    state_load_ms              loading every monitor's stored problems, as lintmon-status does
+    state_save_ms              saving one file's changed problems
+    daemon_rss_mb              lintmond's peak resident set size
+
+The results are printed and, with --output, written as JSON. With --baseline, they're compared
+against an earlier --output, and the exit code is 1 if any metric has regressed by more than its
+threshold. Only needs Linux (for /proc) and this checkout: nothing is fetched or installed.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+FAKE_LINTER = os.path.join(ROOT_DIR, 'benchmarks', 'fake_linter.py')
+sys.path.insert(0, ROOT_DIR)
+
+# metric: (whether higher or lower is better, default regression threshold as a fraction)
+METRICS = {
+    'run_all_files_per_second': ('higher', 0.2),
+    'status_prompt_ms': ('lower', 0.2),
+    'event_to_badge_ms': ('lower', 0.2),
+    'state_load_ms': ('lower', 0.25),
+    'state_save_ms': ('lower', 0.25),
+    'daemon_rss_mb': ('lower', 0.1),
+}
+PROBLEM_LINE_PATTERN = (
+    r'^(?P<file>.*\.py):(?P<line>\d+):(?P<col>\d+): (?P<code>[A-Z]+\d+) (?P<message>.*)$'
+)
+DAEMON_START_SECONDS = 30
+EVENT_TIMEOUT_SECONDS = 30
+
+
+# --------------------------------------------------------------------------------------------------
+# Synthetic repository
+# --------------------------------------------------------------------------------------------------
+def make_repo(root, args):
+    rng = random.Random(args.seed)
+    files = []
+    for i in range(args.files):
+        file = os.path.join(f'pkg{i % args.dirs}', f'module{i}.py')
+        os.makedirs(os.path.join(root, os.path.dirname(file)), exist_ok=True)
+        lines = [f'value_{n} = {n}\n' for n in range(args.lines_per_file)]
+        for n in range(len(lines)):
+            if rng.random() < args.problem_rate:
+                lines[n] = f'value_{n} = {n}  # problem\n'
+        with open(os.path.join(root, file), 'w') as stream:
+            stream.writelines(lines)
+        files.append(file)
+
+    command = [
+        sys.executable,
+        FAKE_LINTER,
+        '--seconds',
+        str(args.linter_seconds),
+        '--seconds-per-file',
+        str(args.linter_seconds_per_file),
+        '--noise-lines',
+        str(args.noise_lines),
+    ]
+    config = {
+        'monitors': {
+            f'fake{m}': {
+                'command': command,
+                'file_pattern': r'.*\.py$',
+                'problem_line_file_pattern': PROBLEM_LINE_PATTERN,
+            }
+            for m in range(args.monitors)
+        },
+        'watcher': args.watcher,
+    }
+    # lintmon.yaml is YAML, but JSON is YAML too and needs no third party module here
+    with open(os.path.join(root, 'lintmon.yaml'), 'w') as stream:
+        json.dump(config, stream, indent=2)
+
+    return files
+
+
+# --------------------------------------------------------------------------------------------------
+# Measurements
+# --------------------------------------------------------------------------------------------------
+def lintmon_command(entry_point, *args):
+    """The command to run one of lintmon's entry points from this checkout."""
+    module, name = entry_point.rsplit('.', 1)
+    code = f'import sys; from {module} import {name}; sys.exit({name}())'
+    return [sys.executable, '-c', code, *args]
+
+
+def lintmon_env():
+    pythonpath = os.pathsep.join([ROOT_DIR, os.environ.get('PYTHONPATH', '')])
+    return {**os.environ, 'PYTHONPATH': pythonpath}
+
+
+def measure_run_all(files):
+    start = time.perf_counter()
+    subprocess.run(
+        lintmon_command('lintmon.cli.run_all', '--full'),
+        env=lintmon_env(),
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return len(files) / (time.perf_counter() - start)
+
+
+def start_daemon():
+    daemon = subprocess.Popen(
+        lintmon_command('lintmon.cli.lintmond'),
+        env=lintmon_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + DAEMON_START_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            health = query({'query': 'health'})
+        except OSError:
+            time.sleep(0.05)
+            continue
+
+        # wait for it to finish catching up with anything changed since it last ran
+        busy = any(m['running'] or m['pending_files'] for m in health['monitors'].values())
+        if health['watcher']['alive'] and not busy:
+            return daemon
+        time.sleep(0.05)
+
+    daemon.kill()
+    raise RuntimeError('lintmond did not start')
+
+
+def query(request):
+    from lintmon.settings import SOCKET_FILE
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(EVENT_TIMEOUT_SECONDS)
+        sock.connect(SOCKET_FILE)
+        sock.sendall(f'{json.dumps(request)}\n'.encode('utf8'))
+        return json.loads(sock.makefile(encoding='utf8').readline())
+
+
+def measure_status_prompt(repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            lintmon_command('lintmon.prompt.status_prompt'),
+            env=lintmon_env(),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def measure_event_to_badge(files, num_monitors, repeat):
+    from lintmon.settings import SOCKET_FILE
+
+    times = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(EVENT_TIMEOUT_SECONDS)
+        sock.connect(SOCKET_FILE)
+        sock.sendall(b'{"query": "subscribe"}\n')
+        events = sock.makefile(encoding='utf8')
+        assert json.loads(events.readline()) == {'subscribed': True}
+
+        for i in range(repeat):
+            file = files[i % len(files)]
+            with open(file, 'a') as stream:
+                stream.write(f'benchmark_{i} = {i}  # problem\n')
+            start = time.perf_counter()
+
+            saved = set()
+            while len(saved) < num_monitors:
+                event = json.loads(events.readline())
+                if event.get('event') == 'saved':
+                    saved.add(event['monitor'])
+            times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def measure_state(files, repeat):
+    from lintmon.config import load_config_file
+    from lintmon.lintmon import Lintmon
+    from lintmon.problem import Problem
+    from lintmon.settings import CONFIG_FILE
+
+    config = load_config_file(CONFIG_FILE)
+
+    load_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lintmon = Lintmon(config)
+        lintmon.load_latest_sessions()
+        for sess in lintmon.sessions:
+            sess.all_problem_lines()
+        load_times.append((time.perf_counter() - start) * 1000)
+
+    store = Lintmon(config).problem_store(next(iter(config.monitors.values())))
+    save_times = []
+    for i in range(repeat):
+        file = files[i % len(files)]
+        text = f'{file}:1:1: W001 benchmark {i}'
+        problems = [Problem(text, file, 1, 1, 'W001', f'benchmark {i}')]
+        start = time.perf_counter()
+        store.update({file: problems})
+        save_times.append((time.perf_counter() - start) * 1000)
+
+    return load_times, save_times
+
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as stream:
+        for line in stream:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def run_benchmarks(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='lintmon-bench-') as root:
+        files = make_repo(root, args)
+        os.chdir(root)
+
+        results['run_all_files_per_second'] = measure_run_all(files)
+
+        daemon = start_daemon()
+        try:
+            prompt_times = measure_status_prompt(args.repeat)
+            event_times = measure_event_to_badge(files, args.monitors, args.repeat)
+            results['daemon_rss_mb'] = peak_rss_mb(daemon.pid)
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait()
+
+        load_times, save_times = measure_state(files, args.repeat)
+        os.chdir(ROOT_DIR)
+
+    results['status_prompt_ms'] = statistics.median(prompt_times)
+    results['status_prompt_p95_ms'] = percentile(prompt_times, 95)
+    results['event_to_badge_ms'] = statistics.median(event_times)
+    results['event_to_badge_p95_ms'] = percentile(event_times, 95)
+    results['state_load_ms'] = statistics.median(load_times)
+    results['state_save_ms'] = statistics.median(save_times)
+    return results
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# --------------------------------------------------------------------------------------------------
+# Baselines
+# --------------------------------------------------------------------------------------------------
+def compare(results, baseline, threshold=None):
+    """Print how the results compare to the baseline's, and return the metrics that regressed."""
+    regressions = []
+    for metric, (better, default_threshold) in METRICS.items():
+        if metric not in results or metric not in baseline or not baseline[metric]:
+            continue
+
+        change = (results[metric] - baseline[metric]) / baseline[metric]
+        worse = change if better == 'lower' else -change
+        limit = default_threshold if threshold is None else threshold
+        regressed = worse > limit
+        print(
+            f'  {metric:<26}{baseline[metric]:10.2f} -> {results[metric]:10.2f} '
+            f'({change:+.0%}, limit {limit:.0%}){"  REGRESSED" if regressed else ""}'
+        )
+        if regressed:
+            regressions.append(metric)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--dirs', type=int, default=50)
+    parser.add_argument('--lines-per-file', type=int, default=50)
+    parser.add_argument('--problem-rate', type=float, default=0.01, help='per line')
+    parser.add_argument('--monitors', type=int, default=2)
+    parser.add_argument('--linter-seconds', type=float, default=0)
+    parser.add_argument('--linter-seconds-per-file', type=float, default=0)
+    parser.add_argument('--noise-lines', type=int, default=0, help='per file checked')
+    parser.add_argument('--watcher', default='auto')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results to this earlier --output')
+    parser.add_argument(
+        '--threshold', type=float, help='regression threshold for all metrics, e.g. 0.1 for 10%%'
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    print(f'{args.files} files, {args.monitors} monitors')
+    for metric, value in results.items():
+        print(f'  {metric:<26}{value:10.2f}')
+
+    if args.output:
+        params = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}
+        with open(args.output, 'w') as stream:
+            json.dump(
+                {'python': sys.version.split()[0], 'params': params, 'results': results},
+                stream,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        params = baseline['params']
+        if params['files'] != args.files or params['monitors'] != args.monitors:
+            print('Warning: the baseline was run with different parameters')
+        print(f'Compared to {args.baseline}:')
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f'Regressed: {", ".join(regressions)}')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# annotations aren't evaluated, so that the prompt needn't import typing
+from __future__ import annotations
+
+import os
+
+from .settings import BADGE_FILE, CONFIG_FILE
+from .utils import write_file_atomic
+
+
+# The badge file is a precomputed copy of the prompt badge written by lintmond whenever it saves
+# new results. Its first line is the mtime of the config file the badge was computed with, so
+# that an edited config invalidates it; the rest of the file is the badge itself.
+
+
+def config_mtime_ns(root: str = '') -> int | None:
+    try:
+        return os.stat(os.path.join(root, CONFIG_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_badge() -> str | None:
+    """Return the precomputed badge, or None if it is missing or stale."""
+    mtime_ns = config_mtime_ns()
+    if mtime_ns is None:
+        return None
+
+    try:
+        with open(BADGE_FILE) as file:
+            stamp = file.readline()
+            badge = file.read()
+    except FileNotFoundError:
+        return None
+
+    if stamp.strip() != str(mtime_ns):
+        return None
+
+    return badge
+
+
+def write_badge(mtime_ns: int | None, badge: str, root: str = ''):
+    if mtime_ns is None:
+        # we don't know which version of the config this was computed with
+        return
+
+    write_file_atomic(os.path.join(root, BADGE_FILE), f'{mtime_ns}\n{badge}')
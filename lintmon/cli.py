@@ -0,0 +1,501 @@
+"""Entry points for the lintmon commands, other than lintmon-status-prompt (see prompt.py)."""
+import argparse
+import logging
+import logging.config
+import logging.handlers
+import json
+import os
+import socket
+import sys
+from collections import Counter
+from copy import deepcopy
+from subprocess import CalledProcessError
+from signal import SIGTERM
+from time import sleep, time
+
+from .config import load_config_file, BadConfig, load_config_or_exit
+from .discovery import find_all_appropriate_files, git_changed_files
+from .lintmon import Lintmon
+from .metrics import COUNTS, PERCENTILES, TIMINGS, RollingMetrics
+from .shared_daemon import SharedDaemon
+from .prompt import (
+    daemon_address,
+    ensure_lintmon_is_running,
+    is_here,
+    is_shared,
+    is_stopped,
+    lintmon_is_running,
+    lintmon_pid,
+    ping_lintmond,
+)
+from .settings import (
+    CONFIG_FILE,
+    METRICS_FILE,
+    METRICS_FILE_BACKUPS,
+    METRICS_FILE_MAX_BYTES,
+    QUERY_TIMEOUT_SECONDS,
+    SHARED_STATE_DIR,
+    STOP_FILE,
+    STOP_WAIT_SECONDS,
+)
+from .utils import colour_text
+
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'WARNING'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(levelname)s %(message)s'},
+        'file': {'format': '%(asctime)s %(levelname)s: %(message)s'},
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'console': {'level': LOG_LEVEL, 'class': 'logging.StreamHandler', 'formatter': 'simple'},
+        'file': {
+            'level': logging.INFO,
+            'class': 'logging.FileHandler',
+            'filename': '.lintmon/output.log',
+            'formatter': 'file',
+        },
+        'metrics': {
+            'level': logging.INFO,
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': METRICS_FILE,
+            'maxBytes': METRICS_FILE_MAX_BYTES,
+            'backupCount': METRICS_FILE_BACKUPS,
+            # not opened until there are metrics to write
+            'delay': True,
+            'formatter': 'message',
+        },
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'loggers': {
+        'lintmon.metrics': {'level': 'INFO', 'handlers': ['metrics'], 'propagate': False},
+    },
+    'root': {'level': 'DEBUG', 'handlers': ['console', 'file'], 'propagate': False},
+}
+
+log = logging.getLogger()
+
+
+def configure_logging(state_dir=None):
+    # done on demand by each command rather than at import, since configuring the file handler
+    # opens .lintmon/output.log
+    logging_config = LOGGING
+    if state_dir is not None:
+        # the shared lintmond logs to its own directory rather than the project it started in
+        logging_config = deepcopy(LOGGING)
+        logging_config['handlers']['file']['filename'] = os.path.join(state_dir, 'output.log')
+        logging_config['handlers']['metrics']['filename'] = os.path.join(state_dir, 'metrics.jsonl')
+
+    try:
+        logging.config.dictConfig(logging_config)
+    except ValueError as exc:
+        if "Unable to configure handler 'file'" not in str(exc):
+            raise
+
+
+# --------------------------------------------------------------------------------------------------
+# Entry points
+# --------------------------------------------------------------------------------------------------
+def lintmond():
+    parser = argparse.ArgumentParser(
+        prog='lintmond', description='Watch the project and run the monitors on changed files.'
+    )
+    parser.add_argument(
+        '--shared', action='store_true', help="serve all of the user's projects (LINTMON_SHARED)"
+    )
+    parser.add_argument(
+        '--root', action='append', default=[], help='with --shared, a project to start with'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='with --shared, the most linter processes to run at once (default the CPU count)',
+    )
+    parser.add_argument('--quiet', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+
+    if args.shared:
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        configure_logging(SHARED_STATE_DIR)
+        log.debug('Shared lintmond main')
+        SharedDaemon(args.concurrency).run(args.root)
+        return
+
+    configure_logging()
+    # if '--quiet' in sys.argv:
+    #     root_logger = logging.getLogger()
+    #     console_handler = first(h for h in root_logger.handlers if h.name == 'console')
+    #     root_logger.removeHandler(console_handler)
+
+    log.debug('lintmond main')
+
+    lintmon = Lintmon(load_config_or_exit())
+    lintmon.run()
+
+
+def run_all():
+    parser = argparse.ArgumentParser(
+        prog='lintmon-run-all',
+        description='Run the monitors on files that have changed since they were last checked.',
+    )
+    parser.add_argument(
+        '--full', action='store_true', help='run the monitors on all files, changed or not'
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    log.debug('Run all')
+    config = load_config_or_exit()
+    files = find_all_appropriate_files(config)
+    lintmon = Lintmon(config)
+    lintmon.drop_stale_monitors()
+    if args.full:
+        lintmon.update_sessions(files)
+    else:
+        lintmon.update_changed_sessions(files)
+
+    print_sessions(lintmon.sessions)
+
+
+def check():
+    parser = argparse.ArgumentParser(
+        prog='lintmon-check',
+        description=(
+            'Check the files changed since a git ref, e.g. before pushing, linting only those the '
+            'monitors have no up to date results for, and exit with 1 if they have problems.'
+        ),
+    )
+    parser.add_argument(
+        '--since',
+        metavar='REF',
+        help=(
+            'check the files changed since the commit HEAD has in common with REF, e.g. '
+            'origin/main, including uncommitted changes and untracked files (default all files)'
+        ),
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    config = load_config_or_exit()
+    if args.since is None:
+        files = find_all_appropriate_files(config)
+    else:
+        try:
+            files = git_changed_files(args.since, config.root)
+        except (OSError, CalledProcessError) as exc:
+            print(f'Unable to list the files changed since {args.since}: {exc}', file=sys.stderr)
+            return 2
+
+    # files the monitors checked since they last changed, perhaps by lintmond, are up to date, and
+    # of the rest, those whose content is in the result cache needn't be linted again
+    lintmon = Lintmon(config)
+    lintmon.drop_stale_monitors()
+    lintmon.update_changed_sessions(files, all_files=args.since is None)
+
+    files_by_monitor = lintmon.router.files_by_monitor(files)
+    if lintmon.import_graph is not None:
+        lintmon.add_dependents(files_by_monitor)
+
+    num_problems = 0
+    for monitor_config in config.monitors.values():
+        # errors running the monitor are reported as problems in '.'
+        monitor_files = files_by_monitor[monitor_config.name] + [os.curdir]
+        problem_lines = lintmon.problem_store(monitor_config).problem_lines(monitor_files)
+        for problem in (p for problems in problem_lines.values() for p in problems):
+            print(f'{monitor_config.name}: {problem}')
+            num_problems += 1
+
+    num_files = sum(1 for file in files if lintmon.is_monitored(file))
+    num_linted = sum(sess.metrics.get('files_run', 0) for sess in lintmon.sessions)
+    since = '' if args.since is None else f' changed since {args.since}'
+    summary = f'{num_files} files{since} ({num_linted} linted)'
+    if num_problems > 0:
+        print(f'{num_problems} problems in {summary}')
+        return 1
+
+    print(f'✅ no problems in {summary}')
+    return 0
+
+
+def status():
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        prog='lintmon-status',
+        description='Show whether lintmond is running, and the problems the monitors have found.',
+    )
+    parser.add_argument(
+        '--monitor', action='append', help='only show the problems found by this monitor'
+    )
+    parser.add_argument(
+        '--file', action='append', help='only show the problems in this file or directory'
+    )
+    parser.add_argument(
+        '--code', action='append', help='only show problems with codes starting with this, e.g. E'
+    )
+    parser.add_argument(
+        '--by',
+        choices=['file', 'code', 'monitor'],
+        help='count the problems by file, code or monitor instead of listing them',
+    )
+    args = parser.parse_args()
+
+    if not is_here():
+        print('No lintmon.yaml in this directory')
+        return
+
+    if is_stopped():
+        print('🛑 lintmon is stopped')
+    else:
+        ping = ping_lintmond()
+        if ping is not None:
+            print(f'✅ lintmon running pid {json.loads(ping)["pid"]}')
+        elif lintmon_is_running():
+            print(f'✅ lintmon running pid {lintmon_pid()}')
+        else:
+            print('⚠️ lintmon is not running')
+    try:
+        config = load_config_file(CONFIG_FILE)
+    except BadConfig as exc:
+        if 'No such config file' in str(exc):
+            return 0
+        print(colour_text(' ! ', background='red', foreground='white'), end='')
+        return 1
+
+    unknown_monitors = set(args.monitor or []) - set(config.monitors)
+    if len(unknown_monitors) > 0:
+        parser.error(f'unknown monitor {", ".join(sorted(unknown_monitors))}')
+
+    lintmon = Lintmon(config)
+    lintmon.load_latest_sessions()
+
+    if not any([args.monitor, args.file, args.code, args.by]):
+        print_sessions(lintmon.sessions)
+        for sess in lintmon.sessions:
+            print(f'{sess} result cache: {sess.result_cache}')
+        return
+
+    problems = filter_problems(
+        lintmon.sessions,
+        monitors=args.monitor,
+        files=args.file and [config.normalize_path(f) or f for f in args.file],
+        codes=args.code,
+    )
+    if args.by is None:
+        for sess, problem in problems:
+            print(f'{sess}: {problem}')
+        return
+
+    counts = Counter(
+        str(sess) if args.by == 'monitor' else getattr(problem, args.by) or '-'
+        for sess, problem in problems
+    )
+    for key, count in counts.most_common():
+        print(f'{count:>6} {key}')
+
+
+def status_prompt_from_state():
+    # the slow path of lintmon-status-prompt, for when there is no up to date badge file
+    configure_logging()
+
+    try:
+        config = load_config_file(CONFIG_FILE)
+    except BadConfig as exc:
+        if 'No such config file' in str(exc):
+            return 0
+        print(colour_text(' ! ', background='red', foreground='white'), end='')
+        return 1
+
+    lintmon = Lintmon(config)
+    lintmon.load_latest_sessions()
+    lintmon.save_badge()
+
+    print(lintmon.badges, end='')
+    log.debug('status_prompt finished')
+
+
+def start():
+    configure_logging()
+    if is_stopped():
+        os.remove(STOP_FILE)
+
+    ensure_lintmon_is_running()
+
+
+def stop():
+    configure_logging()
+    if not is_stopped():
+        with open(STOP_FILE, 'w'):
+            pass
+
+    if is_shared():
+        # the shared lintmond carries on serving the user's other projects
+        try:
+            reply = query_lintmond({'query': 'unregister'})
+        except OSError:
+            print('Not running')
+            return
+        print('Stopped' if reply.get('unregistered') else 'Not running')
+        return
+
+    pid = lintmon_pid()
+    if pid is None:
+        print('Not running')
+        return
+
+    print(f'Sending SIGTERM to {pid}')
+    os.kill(pid, SIGTERM)
+
+    print(f'Waiting up to {STOP_WAIT_SECONDS} for termination...')
+    start = time()
+    while time() < start + STOP_WAIT_SECONDS:
+        if not lintmon_is_running():
+            print('Terminated')
+            return
+
+        sleep(0.1)
+
+    print(f'{pid} did not terminate')
+
+
+def query():
+    parser = argparse.ArgumentParser(
+        prog='lintmon-query',
+        description='Query the running lintmond, printing its replies.',
+    )
+    parser.add_argument(
+        'query', choices=['ping', 'badge', 'count', 'problems', 'health', 'stats', 'subscribe']
+    )
+    parser.add_argument(
+        'files', nargs='*', help='for problems, the files to get the problems of (default all)'
+    )
+    args = parser.parse_args()
+    if len(args.files) > 0 and args.query != 'problems':
+        parser.error(f'{args.query} does not take files')
+
+    socket_file, root = daemon_address()
+    request = {'query': args.query}
+    if len(args.files) > 0:
+        request['files'] = args.files
+    if root is not None:
+        request['root'] = root
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(QUERY_TIMEOUT_SECONDS)
+            sock.connect(socket_file)
+            sock.sendall(f'{json.dumps(request)}\n'.encode('utf8'))
+            if args.query == 'subscribe':
+                sock.settimeout(None)
+
+            for line in sock.makefile(encoding='utf8'):
+                print(line, end='', flush=True)
+                if args.query != 'subscribe':
+                    return 0
+    except OSError as exc:
+        print(f'Unable to query lintmond: {exc}', file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+
+
+def stats():
+    parser = argparse.ArgumentParser(
+        prog='lintmon-stats',
+        description="Show percentiles of the monitors' timings over their recent runs.",
+    )
+    parser.add_argument('--monitor', action='append', help='only show the stats of this monitor')
+    parser.add_argument('--json', action='store_true', help='print the percentiles as JSON')
+    args = parser.parse_args()
+
+    # lintmond has the most recent runs to hand, otherwise we go through the metrics files
+    try:
+        percentiles = query_lintmond({'query': 'stats'})['monitors']
+        source = 'lintmond'
+    except (OSError, KeyError):
+        percentiles = RollingMetrics.from_lines(read_metrics_lines()).percentiles()
+        source = METRICS_FILE
+
+    if args.monitor:
+        percentiles = {m: p for m, p in percentiles.items() if m in args.monitor}
+
+    if args.json:
+        print(json.dumps(percentiles, indent=2))
+        return 0
+
+    if len(percentiles) == 0:
+        print(f'No runs recorded in {source}')
+        return 0
+
+    for monitor, metrics in percentiles.items():
+        print(f'{monitor} ({metrics["total"]["count"]} runs, from {source})')
+        print(f'  {"":<12}' + ''.join(f'{f"p{pct}":>10}' for pct in PERCENTILES))
+        for name in TIMINGS + COUNTS:
+            if name not in metrics:
+                continue
+            if name in TIMINGS:
+                values = [f'{metrics[name][f"p{pct}"] * 1000:8.1f}ms' for pct in PERCENTILES]
+            else:
+                values = [f'{metrics[name][f"p{pct}"]:10d}' for pct in PERCENTILES]
+            print(f'  {name:<12}' + ''.join(values))
+
+    return 0
+
+
+# --------------------------------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------------------------------
+def query_lintmond(request):
+    socket_file, root = daemon_address()
+    if root is not None:
+        request = {'root': root, **request}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(QUERY_TIMEOUT_SECONDS)
+        sock.connect(socket_file)
+        sock.sendall(f'{json.dumps(request)}\n'.encode('utf8'))
+        return json.loads(sock.makefile(encoding='utf8').readline())
+
+
+def read_metrics_lines():
+    # oldest first, so that the most recent runs are the ones kept
+    files = [f'{METRICS_FILE}.{n}' for n in range(METRICS_FILE_BACKUPS, 0, -1)] + [METRICS_FILE]
+    for file in files:
+        try:
+            with open(file, encoding='utf8') as stream:
+                yield from stream
+        except FileNotFoundError:
+            continue
+
+
+def filter_problems(sessions, monitors=None, files=None, codes=None):
+    """Yield (session, problem) for the stored problems matching all of the filters given."""
+    dir_prefixes = files and tuple(os.path.join(f, '') for f in files if f != os.curdir)
+    for sess in sessions:
+        if monitors and sess.config.name not in monitors:
+            continue
+
+        for problems in sess.all_problem_lines().values():
+            for problem in problems:
+                if files and os.curdir not in files:
+                    if problem.file not in files and not problem.file.startswith(dir_prefixes):
+                        continue
+                if codes and not (problem.code and problem.code.startswith(tuple(codes))):
+                    continue
+                yield sess, problem
+
+
+def print_sessions(sessions):
+    for ms in sessions:
+        if ms.num_problems == 0:
+            print(f'✅ {ms} clean')
+            continue
+
+        coloured = ms.badge
+        print(f'{coloured} {ms} output:')
+        for ol in (pl for pls in ms.all_problem_lines().values() for pl in pls):
+            print(f'  {ol}')
@@ -1,12 +1,36 @@
+import hashlib
+import json
 import logging
 import os
 import re
 import sys
-
-import yaml
-
-from .settings import CONFIG_FILE
-from .utils import colour_text
+from functools import lru_cache
+
+from .settings import (
+    CONFIG_CACHE_FILE,
+    CONFIG_FILE,
+    DEBOUNCE_SECONDS,
+    DEPENDENTS_DEPTH,
+    DISCOVERY_NAMES,
+    IO_PRIORITY,
+    IO_PRIORITY_NAMES,
+    MAX_DEBOUNCE_SECONDS,
+    MAX_DEFER_SECONDS,
+    MAX_LINTER_CPU,
+    MAX_LOAD,
+    MAX_PROBLEM_LINES,
+    MAX_PROBLEM_LINES_PER_FILE,
+    NICE,
+    OK_EXIT_CODES,
+    RELINTING_MARK,
+    RESULT_CACHE_SIZE,
+    SCOPE_NAMES,
+    URGENT_MAX_FILES,
+    WARM_WORKER_MAX_JOBS,
+    WATCHER_NAMES,
+)
+from .problem import Problem
+from .utils import colour_text, write_file_atomic
 
 
 log = logging.getLogger(__name__)
@@ -29,24 +53,46 @@ class BadConfig(ValueError):
     pass
 
 
-class ConfigObject:
-    @staticmethod
-    def normalize_path(path: str):
-        path = os.path.normpath(path.strip())
+def parse_int(value):
+    return int(value) if value is not None and value.isdigit() else None
 
-        if os.path.isabs(path):
-            cwd = os.getcwd()
-            if os.path.commonpath([path, cwd]) != cwd:
-                # this path is not in our directory
-                return None
 
-            return os.path.relpath(path)
+@lru_cache(maxsize=None)
+def current_directory():
+    # lintmon never changes directory, so we only need to ask once
+    return os.getcwd()
 
-        if path.split(os.sep)[0] == os.pardir:
-            # this file is not in our directory
+
+@lru_cache(maxsize=4096)
+def normalize_path(path, root):
+    """Return the path relative to the project's root directory, or None if it's not in it."""
+    path = os.path.normpath(path.strip())
+
+    if os.path.isabs(path):
+        if os.path.commonpath([path, root]) != root:
+            # this path is not in our directory
             return None
 
-        return path
+        return os.path.relpath(path, root)
+
+    if path.split(os.sep)[0] == os.pardir:
+        # this file is not in our directory
+        return None
+
+    return path
+
+
+class ConfigObject:
+    # the project's directory, which the paths of its files are relative to, or '' for the current
+    # directory (as it is unless this is the shared lintmond)
+    root = ''
+
+    def normalize_path(self, path):
+        return normalize_path(path, self.root or current_directory())
+
+    def path(self, *parts):
+        """A path in the project that lintmon can use whatever its current directory."""
+        return os.path.join(self.root, *parts)
 
     def _check_and_init_pattern(self, attr, pattern):
         assert attr.endswith('pattern')
@@ -61,6 +107,37 @@ class ConfigObject:
 
         setattr(self, attr.replace('pattern', 'regex'), regex)
 
+    def _check_and_init_number(self, attr, value, type_=int, minimum=0, maximum=None):
+        # bool is a subclass of int, but `true` is never what someone means by a number
+        types = (int, float) if type_ is float else (int,)
+        if isinstance(value, bool) or not isinstance(value, types) or value < minimum:
+            raise BadConfig(f'{attr} must be a number no less than {minimum}')
+        if maximum is not None and value > maximum:
+            raise BadConfig(f'{attr} must be a number no more than {maximum}')
+
+        setattr(self, attr, value)
+
+    def cache_data(self):
+        """The validated options as JSON-able data, which from_cache_data() turns back into this."""
+        # the root and mtime depend on where and when the config was loaded, not what's in it
+        return dict(
+            normalize_key_value(key, value)
+            for key, value in self.__dict__.items()
+            if key not in ('root', 'mtime_ns')
+        )
+
+    @classmethod
+    def from_cache_data(cls, data, root=''):
+        """Rebuild the object from cache_data() without validating the options again."""
+        self = cls.__new__(cls)
+        for key, value in data.items():
+            if key.endswith('pattern'):
+                self._check_and_init_pattern(key, value)
+            else:
+                setattr(self, key, value)
+        self.root = root
+        return self
+
     def __repr__(self):
         return f'{type(self).__name__}({dict_to_kwarg_str(self.__dict__)})'
 
@@ -77,6 +154,16 @@ class MonitorConfig(ConfigObject):
         problem_line_file_pattern=None,
         foreground_colour=None,
         background_colour=None,
+        result_cache_size=RESULT_CACHE_SIZE,
+        concurrency=None,
+        worker=False,
+        worker_max_jobs=WARM_WORKER_MAX_JOBS,
+        max_problem_lines_per_file=MAX_PROBLEM_LINES_PER_FILE,
+        max_problem_lines=MAX_PROBLEM_LINES,
+        scope='files',
+        dependents_depth=DEPENDENTS_DEPTH,
+        config_files=None,
+        ok_exit_codes=OK_EXIT_CODES,
     ):
         self.name = name
 
@@ -94,6 +181,23 @@ class MonitorConfig(ConfigObject):
 
         self._check_and_init_pattern('file_pattern', file_pattern)
         self._check_and_init_pattern('problem_line_file_pattern', problem_line_file_pattern)
+        if self.problem_line_file_regex is not None:
+            if self.problem_line_file_regex.groups == 0:
+                raise BadConfig(
+                    'problem_line_file_pattern must have a group matching the file name, either '
+                    'a group named file or the first group'
+                )
+            named_groups = set(self.problem_line_file_regex.groupindex)
+            if len(named_groups) > 0 and 'file' not in named_groups:
+                raise BadConfig(
+                    'problem_line_file_pattern has named groups, so must have a group named file'
+                )
+            unknown_groups = named_groups - set(Problem.FIELDS)
+            if len(unknown_groups) > 0:
+                raise BadConfig(
+                    f'problem_line_file_pattern has unknown named groups '
+                    f'{", ".join(sorted(unknown_groups))} (expected {", ".join(Problem.FIELDS)})'
+                )
 
         if foreground_colour is not None:
             try:
@@ -109,11 +213,60 @@ class MonitorConfig(ConfigObject):
                 raise BadConfig('Unknown background color')
         self.background_colour = background_colour
 
+        self._check_and_init_number('result_cache_size', result_cache_size)
+        if concurrency is None:
+            concurrency = default_concurrency()
+        self._check_and_init_number('concurrency', concurrency, minimum=1)
+
+        if not isinstance(worker, bool) and (
+            not isinstance(worker, list)
+            or len(worker) == 0
+            or any(not isinstance(worker_arg, str) for worker_arg in worker)
+        ):
+            raise BadConfig('worker must be true, false or a command as a non-empty list')
+        self.worker = worker
+        self._check_and_init_number('worker_max_jobs', worker_max_jobs, minimum=1)
+        self._check_and_init_number(
+            'max_problem_lines_per_file', max_problem_lines_per_file, minimum=1
+        )
+        self._check_and_init_number('max_problem_lines', max_problem_lines, minimum=1)
+
+        if scope not in SCOPE_NAMES:
+            raise BadConfig(f'scope must be one of {", ".join(SCOPE_NAMES)}')
+        self.scope = scope
+        self._check_and_init_number('dependents_depth', dependents_depth)
+
+        if config_files is None:
+            config_files = []
+        if not isinstance(config_files, list) or any(
+            not isinstance(file, str) or os.path.isabs(file) for file in config_files
+        ):
+            raise BadConfig('config_files must be a list of paths relative to the project')
+        self.config_files = [os.path.normpath(file) for file in config_files]
+
+        if (
+            not isinstance(ok_exit_codes, (list, tuple))
+            or len(ok_exit_codes) == 0
+            or any(isinstance(code, bool) or not isinstance(code, int) for code in ok_exit_codes)
+        ):
+            raise BadConfig('ok_exit_codes must be a non-empty list of exit statuses')
+        self.ok_exit_codes = list(ok_exit_codes)
+
+    def lint_key(self):
+        """The options the monitor's problems depend on, which are only valid while these are."""
+        return (
+            self.command,
+            self.worker,
+            self.file_regex and self.file_regex.pattern,
+            self.problem_line_file_regex and self.problem_line_file_regex.pattern,
+        )
+
     def includes_file(self, filepath):
         filedir, filename = os.path.split(filepath)
         return self.file_regex is None or bool(self.file_regex.search(filename))
 
-    def extract_file_from_problem_line(self, line):
+    def parse_problem_line(self, line):
+        """Return the Problem a line of output reports, or None if it isn't about a file."""
         if self.problem_line_file_regex is None:
             return None
 
@@ -121,20 +274,35 @@ class MonitorConfig(ConfigObject):
         if mo is None:
             return None
 
-        try:
-            return self.normalize_path(mo.group(1))
-        except IndexError:
+        groups = mo.groupdict()
+        file = groups['file'] if 'file' in groups else mo.group(1)
+        if file is None:
+            # the group is optional, and didn't match
+            return None
+
+        file = self.normalize_path(file)
+        if file is None:
             return None
 
-    def badge_for_number(self, number):
-        if number == 0:
+        return Problem(
+            line,
+            file,
+            line=parse_int(groups.get('line')),
+            col=parse_int(groups.get('col')),
+            code=groups.get('code'),
+            message=groups.get('message'),
+        )
+
+    def badge_for_number(self, number, relinting=False):
+        # while all the files are being checked again the number may be out of date
+        if number == 0 and not relinting:
             return ''
         kwargs = {}
         if self.foreground_colour is not None:
             kwargs['foreground'] = self.foreground_colour
         if self.background_colour is not None:
             kwargs['background'] = self.background_colour
-        return colour_text(f' {number} ', **kwargs)
+        return colour_text(f' {number}{RELINTING_MARK if relinting else ""} ', **kwargs)
 
         # ----------------------------------------------------------------------------------------------
         # Magic methods
@@ -143,7 +311,23 @@ class MonitorConfig(ConfigObject):
 
 
 class GlobalConfig(ConfigObject):
-    def __init__(self, monitors=None):
+    def __init__(
+        self,
+        monitors=None,
+        debounce_seconds=DEBOUNCE_SECONDS,
+        max_debounce_seconds=MAX_DEBOUNCE_SECONDS,
+        concurrency=None,
+        watcher='auto',
+        discovery='walk',
+        nice=NICE,
+        io_priority=IO_PRIORITY,
+        max_load=MAX_LOAD,
+        max_linter_cpu=MAX_LINTER_CPU,
+        urgent_max_files=URGENT_MAX_FILES,
+        max_defer_seconds=MAX_DEFER_SECONDS,
+        root='',
+    ):
+        self.root = root
         if monitors is None:
             raise BadConfig('No monitors specified')
 
@@ -157,31 +341,89 @@ class GlobalConfig(ConfigObject):
 
         self.monitors = {}
         self.monitor_errors = []
+        # mtime of the config file this was loaded from, if any
+        self.mtime_ns = None
         for name, mon_con in monitors.items():
 
             try:
                 self.monitors[name] = clean_monitor_config(name, mon_con)
+                self.monitors[name].root = root
             except BadConfig as exc:
                 self.monitor_errors.append(f'Monitor "{name}" invalid: {exc}')
 
         if len(self.monitors) == 0:
             raise BadConfig(f'No valid monitors: {"; ".join(self.monitor_errors)}')
 
+        self._check_and_init_number('debounce_seconds', debounce_seconds, float)
+        self._check_and_init_number('max_debounce_seconds', max_debounce_seconds, float)
+        if concurrency is None:
+            concurrency = default_concurrency()
+        self._check_and_init_number('concurrency', concurrency, minimum=1)
+
+        if watcher not in WATCHER_NAMES:
+            raise BadConfig(f'watcher must be one of {", ".join(WATCHER_NAMES)}')
+        self.watcher = watcher
+
+        if discovery not in DISCOVERY_NAMES:
+            raise BadConfig(f'discovery must be one of {", ".join(DISCOVERY_NAMES)}')
+        self.discovery = discovery
+
+        self._check_and_init_number('nice', nice, maximum=19)
+        if io_priority not in IO_PRIORITY_NAMES:
+            raise BadConfig(f'io_priority must be one of {", ".join(IO_PRIORITY_NAMES)}')
+        self.io_priority = io_priority
+        self._check_and_init_number('max_load', max_load, float)
+        self._check_and_init_number('max_linter_cpu', max_linter_cpu, float)
+        self._check_and_init_number('urgent_max_files', urgent_max_files)
+        self._check_and_init_number('max_defer_seconds', max_defer_seconds, float)
+
         log.debug('cleaned config: %r', self)
 
+    def cache_data(self):
+        data = super().cache_data()
+        data['monitors'] = {name: monitor.cache_data() for name, monitor in self.monitors.items()}
+        return data
+
+    @classmethod
+    def from_cache_data(cls, data, root=''):
+        self = super().from_cache_data(data, root)
+        self.monitors = {
+            name: MonitorConfig.from_cache_data(monitor_data, root)
+            for name, monitor_data in data['monitors'].items()
+        }
+        self.mtime_ns = None
+        return self
+
+
+def default_concurrency():
+    return os.cpu_count() or 1
+
+
+def check_option_names(options):
+    # YAML allows keys that aren't strings, which can't be options (and wouldn't survive the cache)
+    for key in options:
+        if not isinstance(key, str):
+            raise BadConfig(f'Unknown option {key!r}')
+
 
 def clean_monitor_config(name, monitor_config):
+    if not isinstance(name, str):
+        raise BadConfig('Monitor name must be a string')
     if not isinstance(monitor_config, dict):
         raise BadConfig('Not a dictionary')
+    check_option_names(monitor_config)
 
     return MonitorConfig(name, **monitor_config)
 
 
-def clean_config(config):
+def clean_config(config, root=''):
     if not isinstance(config, dict):
         raise BadConfig('Config is not a dictionary')
+    check_option_names(config)
+    if 'root' in config:
+        raise BadConfig('Unknown option root')
 
-    return GlobalConfig(**config)
+    return GlobalConfig(**config, root=root)
 
 
 def load_config_file(config_file):
@@ -189,14 +431,82 @@ def load_config_file(config_file):
     if not os.path.exists(config_file):
         raise BadConfig('No such config file')
 
-    with open(config_file, "r") as stream:
+    with open(config_file, 'rb') as stream:
+        content = stream.read()
+        stat = os.fstat(stream.fileno())
+
+    # the config file is at the root of the project
+    root = os.path.dirname(config_file)
+    fingerprint = config_fingerprint(stat, content)
+    cached = read_config_cache(root, fingerprint)
+    if cached is not None:
+        log.debug('Config cache hit')
+        if 'error' in cached:
+            raise BadConfig(cached['error'])
+        config = GlobalConfig.from_cache_data(cached['config'], root)
+    else:
         try:
-            config = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            oneline_exc = str(exc).replace('\n', ' ')
-            raise BadConfig(f'Invaid YAML file: {oneline_exc}') from exc
+            raw_config = parse_config(content)
+            config = clean_config(raw_config, root)
+        except BadConfig as exc:
+            write_config_cache(root, fingerprint, error=str(exc))
+            raise
+        write_config_cache(root, fingerprint, config=config.cache_data())
+
+    config.mtime_ns = stat.st_mtime_ns
+    return config
 
-    return clean_config(config)
+
+def parse_config(content):
+    # yaml is slow to import and only needed when the config cache misses
+    import yaml
+
+    try:
+        return yaml.safe_load(content)
+    except yaml.YAMLError as exc:
+        oneline_exc = str(exc).replace('\n', ' ')
+        raise BadConfig(f'Invaid YAML file: {oneline_exc}') from exc
+
+
+def config_fingerprint(stat, content):
+    # include this module's mtime so that upgrading lintmon, which may change what is valid,
+    # invalidates any cached config or errors, and the default concurrency, which the cached
+    # config has already filled in
+    return [
+        stat.st_size,
+        stat.st_mtime_ns,
+        hashlib.sha256(content).hexdigest(),
+        os.stat(__file__).st_mtime_ns,
+        default_concurrency(),
+    ]
+
+
+def read_config_cache(root, fingerprint):
+    try:
+        with open(os.path.join(root, CONFIG_CACHE_FILE)) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get('fingerprint') != fingerprint:
+        return None
+
+    return cached
+
+
+def write_config_cache(root, fingerprint, **result):
+    try:
+        text = json.dumps({'fingerprint': fingerprint, **result})
+    except (TypeError, ValueError):
+        # an option had a value we can't represent, so just don't cache it
+        log.debug('Config not cacheable')
+        return
+
+    cache_file = os.path.join(root, CONFIG_CACHE_FILE)
+    try:
+        write_file_atomic(cache_file, text)
+    except OSError as exc:
+        log.warning('Unable to write config cache %s: %s', cache_file, exc)
 
 
 def load_config_or_exit():
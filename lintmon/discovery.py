@@ -0,0 +1,85 @@
+import logging
+import os
+from subprocess import DEVNULL, PIPE, CalledProcessError, run
+
+from .settings import DEFAULT_IGNORED_DIRECTORY_NAMES
+
+
+log = logging.getLogger(__name__)
+
+
+def find_all_appropriate_files(config):
+    if config.discovery == 'git':
+        try:
+            return git_project_files(config.root)
+        except (OSError, CalledProcessError) as exc:
+            log.warning('Unable to list files with git, falling back to walking: %s', exc)
+
+    full_file_paths = []
+    for dirpath, _, files in walk_project(config.root or os.curdir):
+        for file in files:
+            path = os.path.join(dirpath, file)
+            full_file_paths.append(
+                os.path.relpath(path, config.root) if config.root else os.path.normpath(path)
+            )
+
+    return full_file_paths
+
+
+def git_project_files(root=''):
+    """The files in the project tracked by git, or untracked but not ignored."""
+    proc = run(
+        ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard'],
+        stdout=PIPE,
+        stderr=DEVNULL,
+        check=True,
+        cwd=root or None,
+    )
+    # tracked files that have been deleted are listed too, which is fine as checking a deleted
+    # file clears its problems
+    files = (os.fsdecode(f) for f in proc.stdout.split(b'\0') if f)
+    return list(dict.fromkeys(f for f in files if not is_in_ignored_directory(f)))
+
+
+def git_changed_files(ref, root=''):
+    """The files changed since the commit HEAD has in common with the ref, committed or not.
+
+    Untracked files that aren't ignored count as changed, being new.
+    """
+    proc = run(
+        ['git', 'merge-base', ref, 'HEAD'],
+        stdout=PIPE,
+        stderr=DEVNULL,
+        check=True,
+        cwd=root or None,
+    )
+    merge_base = os.fsdecode(proc.stdout.strip())
+    # deleted files are listed too, as with git_project_files
+    proc = run(
+        ['git', 'diff', '--name-only', '-z', '--relative', merge_base, '--'],
+        stdout=PIPE,
+        stderr=DEVNULL,
+        check=True,
+        cwd=root or None,
+    )
+    untracked_proc = run(
+        ['git', 'ls-files', '-z', '--others', '--exclude-standard'],
+        stdout=PIPE,
+        stderr=DEVNULL,
+        check=True,
+        cwd=root or None,
+    )
+    files = (os.fsdecode(f) for p in (proc, untracked_proc) for f in p.stdout.split(b'\0') if f)
+    return list(dict.fromkeys(f for f in files if not is_in_ignored_directory(f)))
+
+
+def is_in_ignored_directory(path):
+    # git always uses / in paths
+    return any(d in DEFAULT_IGNORED_DIRECTORY_NAMES for d in path.split('/')[:-1])
+
+
+def walk_project(top=os.curdir):
+    """os.walk, skipping the directories we never look in."""
+    for dirpath, subdirs, files in os.walk(top):
+        subdirs[:] = [d for d in subdirs if d not in DEFAULT_IGNORED_DIRECTORY_NAMES]
+        yield dirpath, subdirs, files
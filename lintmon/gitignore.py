@@ -0,0 +1,167 @@
+"""Matching paths against a git repository's ignore rules.
+
+Only the rules in the repository itself are used, i.e. its .gitignore files and
+.git/info/exclude, so the results match what `git ls-files --exclude-standard` reports except for
+any global excludes file the user has configured.
+"""
+import logging
+import os
+import re
+
+
+log = logging.getLogger(__name__)
+
+
+def find_git_root(path=os.curdir):
+    path = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            return path
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+class GitIgnoreRule:
+    def __init__(self, pattern, base):
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+
+        self.directory_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+
+        # a pattern with a slash anywhere but the end only matches relative to the directory of
+        # the .gitignore it's in, otherwise it matches at any depth below it
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = re.escape(f'{base}/') if base else ''
+        if not anchored:
+            prefix += '(?:.*/)?'
+        self.regex = re.compile(f'^{prefix}{translate_glob(pattern)}$')
+
+    def matches(self, path, is_dir):
+        if self.directory_only and not is_dir:
+            return False
+        return self.regex.match(path) is not None
+
+
+def translate_glob(pattern):
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+            continue
+
+        if pattern.startswith('/**', i) and i + 3 == len(pattern):
+            parts.append('/.*')
+            i += 3
+            continue
+
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '\\' and i < len(pattern):
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                parts.append(re.escape(char))
+                continue
+            chars = pattern[i:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            parts.append(f'[{chars}]')
+            i = end + 1
+        else:
+            parts.append(re.escape(char))
+
+    return ''.join(parts)
+
+
+def parse_ignore_file(filepath, base):
+    rules = []
+    try:
+        with open(filepath, encoding='utf8', errors='replace') as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return rules
+
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        # trailing spaces are ignored unless escaped
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        if stripped.startswith('\\'):
+            stripped = stripped[1:]
+        if stripped.strip() == '':
+            continue
+        try:
+            rules.append(GitIgnoreRule(stripped, base))
+        except re.error:
+            log.debug('Ignoring bad pattern %r in %s', line, filepath)
+
+    return rules
+
+
+class GitIgnore:
+    """The ignore rules of the git repository containing the project's directory."""
+
+    @classmethod
+    def for_project(cls, gitignore_files, root=''):
+        """Load the rules, given the paths of the .gitignore files in the project."""
+        git_root = find_git_root(root or os.curdir)
+        if git_root is None:
+            return None
+
+        # paths are relative to the project's directory, which may be below the root of the repo
+        prefix = os.path.relpath(os.path.abspath(root or os.curdir), git_root)
+        prefix = '' if prefix == os.curdir else prefix
+
+        rules = parse_ignore_file(os.path.join(git_root, '.git', 'info', 'exclude'), '')
+
+        # .gitignore files above us in the repository...
+        ancestor = ''
+        for part in ([] if prefix == '' else prefix.split(os.sep)):
+            rules += parse_ignore_file(os.path.join(git_root, ancestor, '.gitignore'), ancestor)
+            ancestor = os.path.join(ancestor, part)
+
+        # ...and in the project, shallowest first so that deeper ones take precedence
+        for gitignore_file in sorted(gitignore_files, key=lambda f: f.count(os.sep)):
+            base = os.path.join(prefix, os.path.dirname(gitignore_file)).strip(os.sep)
+            rules += parse_ignore_file(os.path.join(root, gitignore_file), base)
+
+        log.debug('Loaded %d gitignore rules', len(rules))
+        return cls(rules, prefix)
+
+    def __init__(self, rules, prefix):
+        self.rules = rules
+        self.prefix = prefix
+
+    def is_ignored(self, path):
+        """Whether a path relative to the current directory is ignored."""
+        path = os.path.join(self.prefix, os.path.normpath(path)).replace(os.sep, '/')
+        parts = path.split('/')
+        # a file in an ignored directory is ignored whatever rules match the file itself
+        for depth in range(1, len(parts) + 1):
+            if self._matches(parts[:depth], is_dir=depth < len(parts)):
+                return True
+        return False
+
+    def _matches(self, parts, is_dir):
+        path = '/'.join(parts)
+        ignored = False
+        for rule in self.rules:
+            if rule.negated == ignored and rule.matches(path, is_dir):
+                ignored = not rule.negated
+        return ignored
@@ -0,0 +1,203 @@
+import ast
+import json
+import logging
+import os
+from threading import Lock
+
+from .settings import IMPORT_GRAPH_FILE
+from .stat_index import stat_key
+from .utils import write_file_atomic
+
+
+log = logging.getLogger(__name__)
+
+
+class ImportGraph:
+    """Which of the project's Python files import which modules, and so which import each other.
+
+    This is for monitors with the dependents scope, which check the files that import a changed
+    file as well as the file itself, as cross-file checkers such as mypy may find new problems in
+    them. Only changed files are parsed again, and the imports of each file are saved along with
+    its stat so that they needn't all be parsed again when lintmon next starts.
+
+    A file's module names are worked out from the packages (directories with an __init__.py) it's
+    in, and also from the project directory, so that both `src/pkg/mod.py` and plain directories
+    used as namespace packages are covered. Imports of modules outside the project are ignored.
+    """
+
+    @classmethod
+    def for_project(cls, root=''):
+        return cls(os.path.join(root, IMPORT_GRAPH_FILE), root)
+
+    def __init__(self, filepath, root=''):
+        self.filepath = filepath
+        # the directory the paths of the files are relative to
+        self.root = root
+        # file -> (stat key, the names of the modules it imports)
+        self.imports = None
+        # module name -> the files importing it
+        self.importers = {}
+        self.package_dirs = {}
+        self.lock = Lock()
+
+    def update(self, files):
+        """Parse the imports of those of the files that are Python and have changed."""
+        with self.lock:
+            self._ensure_loaded()
+            num_parsed = 0
+            for file in files:
+                if not file.endswith('.py'):
+                    continue
+                if os.path.basename(file) == '__init__.py':
+                    # a directory may have become a package, or stopped being one
+                    self.package_dirs.pop(os.path.dirname(file), None)
+
+                key = stat_key(os.path.join(self.root, file))
+                entry = self.imports.get(file)
+                if entry is not None and entry[0] == key:
+                    continue
+
+                if entry is not None:
+                    self._remove_importer(file, entry[1])
+                if key is None:
+                    self.imports.pop(file, None)
+                    continue
+
+                imported = self._parse_imports(file)
+                self.imports[file] = (key, imported)
+                self._add_importer(file, imported)
+                num_parsed += 1
+
+        if num_parsed > 0:
+            log.debug('Parsed the imports of %d files', num_parsed)
+        return num_parsed
+
+    def dependents(self, files, depth=0):
+        """The files, and the files that import them directly or indirectly.
+
+        With a depth, only include importers up to that many imports away, e.g. 1 for just the
+        files that import the given ones directly.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            found = dict.fromkeys(files)
+            frontier = list(found)
+            level = 0
+            while len(frontier) > 0 and (depth == 0 or level < depth):
+                level += 1
+                next_frontier = []
+                for file in frontier:
+                    if not file.endswith('.py'):
+                        continue
+                    # the file may have just been deleted, in which case its importers are broken
+                    for name in self._module_names(file):
+                        for importer in self.importers.get(name, ()):
+                            if importer not in found:
+                                found[importer] = None
+                                next_frontier.append(importer)
+                frontier = next_frontier
+
+        return list(found)
+
+    def save(self):
+        with self.lock:
+            if self.imports is None:
+                return
+
+            saved = {file: [key, imported] for file, (key, imported) in self.imports.items()}
+            write_file_atomic(self.filepath, json.dumps(saved))
+
+    def _ensure_loaded(self):
+        if self.imports is not None:
+            return
+
+        self.imports = {}
+        try:
+            with open(self.filepath) as stream:
+                saved = json.load(stream)
+            for file, (key, imported) in saved.items():
+                self.imports[file] = (key, imported)
+                self._add_importer(file, imported)
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as exc:
+            log.warning('Ignoring invalid import graph %s: %s', self.filepath, exc)
+            self.imports = {}
+            self.importers = {}
+
+    def _add_importer(self, file, imported):
+        for name in imported:
+            self.importers.setdefault(name, set()).add(file)
+
+    def _remove_importer(self, file, imported):
+        for name in imported:
+            importers = self.importers.get(name)
+            if importers is not None:
+                importers.discard(file)
+                if len(importers) == 0:
+                    del self.importers[name]
+
+    # ----------------------------------------------------------------------------------------------
+    # Module names
+    # ----------------------------------------------------------------------------------------------
+    def _module_names(self, file):
+        """The names a file can be imported as, the name within its packages first."""
+        parts = os.path.splitext(file)[0].split(os.sep)
+        if parts[-1] == '__init__':
+            parts = parts[:-1]
+        if len(parts) == 0:
+            return []
+
+        num_packages = 0
+        directory = os.path.dirname(file)
+        while directory and self._is_package(directory):
+            num_packages += 1
+            directory = os.path.dirname(directory)
+
+        package_parts = parts[-(num_packages + 1):]
+        if os.path.basename(file) == '__init__.py':
+            package_parts = parts[-num_packages:] if num_packages > 0 else parts
+        names = ['.'.join(package_parts)]
+        if len(package_parts) < len(parts):
+            names.append('.'.join(parts))
+        return names
+
+    def _is_package(self, directory):
+        if directory not in self.package_dirs:
+            self.package_dirs[directory] = os.path.exists(
+                os.path.join(self.root, directory, '__init__.py')
+            )
+        return self.package_dirs[directory]
+
+    def _parse_imports(self, file):
+        try:
+            with open(os.path.join(self.root, file), 'rb') as stream:
+                tree = ast.parse(stream.read(), file)
+        except (OSError, SyntaxError, ValueError) as exc:
+            log.debug('Unable to parse the imports of %s: %s', file, exc)
+            return []
+
+        names = self._module_names(file)
+        package = names[0].split('.') if names else []
+        if os.path.basename(file) != '__init__.py':
+            package = package[:-1]
+
+        imported = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    imported[alias.name] = None
+            elif isinstance(node, ast.ImportFrom):
+                if node.level > 0:
+                    base = package[: len(package) - node.level + 1]
+                    module = '.'.join(base + ([node.module] if node.module else []))
+                else:
+                    module = node.module
+                if not module:
+                    continue
+                imported[module] = None
+                # the names may be modules themselves, as in `from package import module`
+                for alias in node.names:
+                    if alias.name != '*':
+                        imported[f'{module}.{alias.name}'] = None
+        return list(imported)
@@ -0,0 +1,73 @@
+"""The config files of the linter a monitor runs, such as setup.cfg or .flake8 for flake8.
+
+A monitor's results depend on these as much as on the files it checks, so their digests are part
+of its result cache keys, and when they change lintmond checks all of the monitor's files again
+in the background (see MonitorWorker.relint). The digests as of the monitor's last check of all
+its files are saved, so that changes made while lintmond wasn't running are noticed too.
+"""
+import json
+import logging
+
+from .settings import STATE_DIR
+from .utils import file_digest, write_file_atomic
+
+
+log = logging.getLogger(__name__)
+
+
+def config_files_digests(config):
+    """The digests of the monitor's config files, None for those that don't exist."""
+    digests = []
+    for file in config.config_files:
+        try:
+            digests.append(file_digest(config.path(file)))
+        except OSError:
+            digests.append(None)
+    return digests
+
+
+def checked_digests_file(config):
+    return config.path(STATE_DIR, 'monitors', config.name, 'config_files.json')
+
+
+def read_checked_digests(config):
+    """The digests of the config files as of the monitor's last full check, if known."""
+    try:
+        with open(checked_digests_file(config)) as stream:
+            checked = json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(checked, dict) or checked.get('files') != config.config_files:
+        return None
+    return checked.get('digests')
+
+
+def write_checked_digests(config, digests=None):
+    if digests is None:
+        digests = config_files_digests(config)
+    try:
+        write_file_atomic(
+            checked_digests_file(config),
+            json.dumps({'files': config.config_files, 'digests': digests}),
+        )
+    except OSError as exc:
+        log.warning('Unable to save the config file digests of %s: %s', config.name, exc)
+
+
+def config_files_changed(config):
+    """Whether the config files have changed since the monitor last checked all its files.
+
+    The first time, there's nothing to compare with, so the config files as they are now are
+    taken to be what it checked with.
+    """
+    if len(config.config_files) == 0:
+        return False
+
+    checked = read_checked_digests(config)
+    current = config_files_digests(config)
+    if checked is None:
+        write_checked_digests(config, current)
+        return False
+
+    return checked != current
@@ -1,14 +1,29 @@
-import atexit
 import logging
 import os
-from queue import SimpleQueue
-from signal import SIGTERM
-from subprocess import Popen, PIPE
-from threading import Thread
+import shutil
+from queue import Empty, SimpleQueue
+from subprocess import CalledProcessError
+from threading import BoundedSemaphore, Lock, Thread
+from time import monotonic, sleep
 
+from .badge import write_badge
+from .config import BadConfig, load_config_file
+from .discovery import find_all_appropriate_files, git_project_files
+from .gitignore import GitIgnore
+from .import_graph import ImportGraph
+from .linter_config import config_files_changed, write_checked_digests
+from .metrics import RollingMetrics, record_session
 from .monitor_session import MonitorSession
-from .settings import DEFAULT_IGNORED_DIRECTORY_NAMES
-from .utils import lf
+from .monitor_worker import MonitorWorker
+from .problem_store import ProblemStore
+from .query_server import QueryServer
+from .result_cache import ResultCache
+from .routing import FileRouter
+from .scheduling import Scheduler
+from .settings import CONFIG_FILE, RUNNING_POLL_SECONDS, STATE_DIR
+from .stat_index import StatIndex
+from .warm_worker import WarmWorker
+from .watchers import create_watcher
 
 log = logging.getLogger(__name__)
 
@@ -16,13 +31,39 @@ log = logging.getLogger(__name__)
 class Lintmon:
     @property
     def badges(self):
-        return ''.join(sess.badge for sess in self.sessions)
+        relinting = {worker.config.name for worker in self.workers if worker.relinting}
+        return ''.join(
+            sess.config.badge_for_number(sess.num_problems, sess.config.name in relinting)
+            for sess in self.sessions
+        )
 
-    def __init__(self, config):
+    def __init__(self, config, process_slots=None, metrics_log=None):
         self.config = config
         self.sessions = []
-        self.fswatch_proc = None
+        self.watcher = None
+        self.query_server = None
+        self.gitignore = None
+        self.router = FileRouter(config.monitors.values())
         self.files_queue = None
+        # each monitor's are created when first needed, by whichever thread needs them first
+        self.problem_stores = {}
+        self.result_caches = {}
+        self.warm_workers = {}
+        self.stat_indexes = {}
+        self.stores_lock = Lock()
+        # held while the config, and what's derived from it, is swapped for a reloaded one
+        self.config_lock = Lock()
+        self.workers = []
+        self.sessions_lock = Lock()
+        # shared between all the projects of the shared lintmond
+        self.process_slots = process_slots or BoundedSemaphore(config.concurrency)
+        self.metrics = RollingMetrics()
+        self.metrics_log = metrics_log
+        self.scheduler = Scheduler(config)
+        # only kept if there are monitors that need it
+        self.import_graph = None
+        if any(mc.scope == 'dependents' for mc in config.monitors.values()):
+            self.import_graph = ImportGraph.for_project(config.root)
 
     def load_latest_sessions(self):
         new_sessions = self.new_sessions([])
@@ -31,75 +72,554 @@ class Lintmon:
 
         self.sessions = new_sessions
 
-    def start_fswatch(self):
-        excluded_dir_paths_options = [
-            arg
-            for dirpattern in (f'{dname}/' for dname in DEFAULT_IGNORED_DIRECTORY_NAMES)
-            for arg in ['--exclude', dirpattern]
-        ]
+    def save_badge(self):
+        write_badge(self.config.mtime_ns, self.badges, self.config.root)
 
-        args = ['fswatch', '--extended', *excluded_dir_paths_options, os.curdir]
-        log.info('Starting fswatch')
-        log.debug('Args: %s', args)
+    def start(self):
+        """Start the monitors' workers, ready for path_changed to be told about changes."""
+        self.drop_stale_monitors()
+        self.load_latest_sessions()
+        if self.config.discovery == 'git':
+            self.load_gitignore()
         self.files_queue = SimpleQueue()
-        self.fswatch = Popen(args, stdout=PIPE, stderr=PIPE, encoding='utf8',)
-        atexit.register(self.fswatch.terminate)
+        self.start_workers()
+
+    def start_reconcile(self):
+        Thread(target=self.reconcile_main, name='reconcile', daemon=True).start()
+
+    def stop(self):
+        if self.files_queue is not None:
+            # for dispatch_main
+            self.files_queue.put(None)
+        self.stop_workers()
+        self.stop_warm_workers()
 
-        # non-daemon thread doesn't need to be joined or terminated: will exit when main thread
-        # exits
-        self.reader = Thread(target=self.reader_main)
-        self.reader.start()
+    def start_watcher(self):
+        self.watcher = create_watcher(
+            self.config.watcher, self.path_changed, known_files=self.known_files
+        )
+        self.watcher.start()
 
-    def stop_fswatch(self):
-        log.debug('Stopping fswatch')
-        self.fswatch.terminate()
+    def stop_watcher(self):
+        self.watcher.stop()
 
     def update_sessions(self, files):
-        new_sessions = self.new_sessions(files)
+        """Check the files, which are all the project's files, with every monitor."""
+        self.run_sessions(self.new_sessions(files))
+        for monitor_config in self.config.monitors.values():
+            if len(monitor_config.config_files) > 0:
+                write_checked_digests(monitor_config)
+
+    def update_changed_sessions(self, files, all_files=True):
+        """Check the files that have changed since each monitor last checked them.
+
+        Monitors whose config files have changed check all the files, and if they're all the
+        project's files, that's recorded so that they needn't be checked again.
+        """
+        relint = [mc for mc in self.config.monitors.values() if config_files_changed(mc)]
+        files_by_monitor = self.changed_files_by_monitor(files)
+        if len(relint) > 0:
+            routed_files = self.router.files_by_monitor(files)
+            for monitor_config in relint:
+                log.info('The config files of %s have changed', monitor_config.name)
+                files_by_monitor[monitor_config.name] = routed_files[monitor_config.name]
+
+        self.run_sessions(
+            [
+                self.new_session(monitor_config, files_by_monitor[monitor_config.name])
+                for monitor_config in self.config.monitors.values()
+            ]
+        )
+        if all_files:
+            for monitor_config in relint:
+                write_checked_digests(monitor_config)
+
+    def changed_files_by_monitor(self, files):
+        """The files that have changed for each monitor, by name, as of the config right now."""
+        snapshot = self.config_snapshot()
+        config, router, import_graph = snapshot
+        files_by_monitor = router.files_by_monitor(files)
+        changed_files_by_monitor = {
+            monitor_config.name: self.stat_index(monitor_config).changed_files(
+                files_by_monitor[monitor_config.name]
+            )
+            for monitor_config in config.monitors.values()
+        }
+        if import_graph is not None:
+            # bring the graph up to date with all the files, not just those changed for a monitor
+            import_graph.update(files)
+            import_graph.save()
+            self.add_dependents(changed_files_by_monitor, snapshot)
+
+        return changed_files_by_monitor
+
+    def config_snapshot(self):
+        # for threads other than the dispatcher, which reloads the config
+        with self.config_lock:
+            return self.config, self.router, self.import_graph
+
+    def add_dependents(self, files_by_monitor, snapshot=None):
+        """Add the files importing the files of monitors with the dependents scope."""
+        config, router, import_graph = snapshot or self.config_snapshot()
+        for monitor_config in config.monitors.values():
+            name = monitor_config.name
+            if monitor_config.scope != 'dependents' or len(files_by_monitor[name]) == 0:
+                continue
+
+            changed_files = files_by_monitor[name]
+            files = import_graph.dependents(changed_files, monitor_config.dependents_depth)
+            files_by_monitor[name] = [f for f in files if name in router.route(f)]
+            num_dependents = len(files_by_monitor[name]) - len(changed_files)
+            if num_dependents > 0:
+                log.info(
+                    'Also checking %d files importing the %d changed for %s',
+                    num_dependents,
+                    len(changed_files),
+                    name,
+                )
+
+    def run_sessions(self, new_sessions):
         for mp in new_sessions:
             mp.start()
-        for mp in new_sessions:
-            mp.join()
-            mp.save()
+
+        # save each session as soon as it's done rather than waiting on them in order
+        running_sessions = list(new_sessions)
+        while len(running_sessions) > 0:
+            for mp in [mp for mp in running_sessions if mp.poll()]:
+                running_sessions.remove(mp)
+                mp.save()
+                self.record_metrics(mp)
+
+            if len(running_sessions) > 0:
+                sleep(RUNNING_POLL_SECONDS)
 
         self.sessions = new_sessions
+        self.save_badge()
 
     def get_next_files(self):
-        # block for the first line
-        lines = [self.files_queue.get()]
-        while not self.files_queue.empty():
-            lines.append(self.files_queue.get())
+        # block for the first path, then keep collecting paths until none have arrived for the
+        # debounce period, or we've been collecting for the maximum debounce period, so that a
+        # burst of changes results in a single run of each monitor. None once we've been stopped
+        file = self.files_queue.get()
+        if file is None:
+            return None
 
-        return lines
+        files = {file: None}
+
+        deadline = monotonic() + self.config.max_debounce_seconds
+        while True:
+            timeout = min(self.config.debounce_seconds, deadline - monotonic())
+            if timeout <= 0:
+                break
+
+            try:
+                file = self.files_queue.get(timeout=timeout)
+            except Empty:
+                break
+
+            if file is None:
+                self.files_queue.put(None)
+                break
+            files[file] = None
+
+        return list(files)
+
+    def start_workers(self):
+        self.workers = [
+            self.new_worker(monitor_config) for monitor_config in self.config.monitors.values()
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def new_worker(self, monitor_config):
+        return MonitorWorker(
+            monitor_config, self.new_session, self.session_saved, self.scheduler, self.relinted
+        )
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def record_metrics(self, session):
+        # sessions that had nothing to check didn't run
+        if session.started_at is not None:
+            self.metrics.add(record_session(session, self.metrics_log))
+
+    def session_saved(self, session):
+        # called from the monitor workers' threads
+        self.record_metrics(session)
+        with self.sessions_lock:
+            self.sessions = [
+                session if sess.config.name == session.config.name else sess
+                for sess in self.sessions
+            ]
+            self.save_badge()
+            badges = self.badges
+
+        if self.query_server is not None:
+            self.query_server.publish(
+                {
+                    'event': 'saved',
+                    'monitor': session.config.name,
+                    'num_problems': session.num_problems,
+                    'badge': badges,
+                }
+            )
+
+    def is_config_file(self, file):
+        return any(file in mc.config_files for mc in self.config.monitors.values())
+
+    def is_monitored(self, file):
+        return len(self.router.route(file)) > 0
 
     def new_sessions(self, files):
+        files_by_monitor = self.router.files_by_monitor(files)
         return [
-            MonitorSession(monitor_config, lf(monitor_config.includes_file, files))
+            self.new_session(monitor_config, files_by_monitor[monitor_config.name])
             for monitor_config in self.config.monitors.values()
         ]
 
-    def reader_main(self):
-        for line in self.fswatch.stdout:
-            line = self.config.normalize_path(line)
-            log.debug('Got another path: %s', line)
-            self.files_queue.put(line)
+    def new_session(self, monitor_config, files):
+        return MonitorSession(
+            monitor_config,
+            files,
+            self.problem_store(monitor_config),
+            self.result_cache(monitor_config),
+            self.process_slots,
+            self.warm_worker(monitor_config),
+            self.stat_index(monitor_config),
+            self.scheduler,
+        )
+
+    def problem_store(self, monitor_config):
+        with self.stores_lock:
+            if monitor_config.name not in self.problem_stores:
+                self.problem_stores[monitor_config.name] = ProblemStore.for_monitor(monitor_config)
+            return self.problem_stores[monitor_config.name]
+
+    def result_cache(self, monitor_config):
+        with self.stores_lock:
+            if monitor_config.name not in self.result_caches:
+                self.result_caches[monitor_config.name] = ResultCache.for_monitor(monitor_config)
+            return self.result_caches[monitor_config.name]
 
-        log.debug('fswatch stdout closed, killing self')
-        os.kill(os.getpid(), SIGTERM)
+    def stat_index(self, monitor_config):
+        with self.stores_lock:
+            if monitor_config.name not in self.stat_indexes:
+                self.stat_indexes[monitor_config.name] = StatIndex.for_monitor(monitor_config)
+            return self.stat_indexes[monitor_config.name]
+
+    def warm_worker(self, monitor_config):
+        if not monitor_config.worker:
+            return None
+
+        with self.stores_lock:
+            if monitor_config.name not in self.warm_workers:
+                self.warm_workers[monitor_config.name] = WarmWorker.for_monitor(
+                    monitor_config, self.scheduler.prioritise
+                )
+            return self.warm_workers[monitor_config.name]
+
+    def stop_warm_workers(self):
+        with self.stores_lock:
+            warm_workers = list(self.warm_workers.values())
+        for warm_worker in warm_workers:
+            warm_worker.interrupt()
+            warm_worker.stop()
+
+    def reconcile_main(self):
+        # catch up with anything that changed while we weren't running, now that we're watching
+        # for new changes
+        try:
+            changed_files_by_monitor = self.changed_files_by_monitor(
+                find_all_appropriate_files(self.config)
+            )
+        except Exception:
+            log.exception('Failed to find files changed while not running')
+            return
+
+        # the config may have been reloaded meanwhile, and monitors changed by that check all their
+        # files anyway
+        for worker in list(self.workers):
+            if config_files_changed(worker.config):
+                self.relint(worker)
+                continue
+
+            changed_files = changed_files_by_monitor.get(worker.config.name, [])
+            if len(changed_files) > 0:
+                log.info('%d files changed for %s while not running', len(changed_files), worker)
+                worker.add_files(changed_files)
+
+    def load_gitignore(self):
+        try:
+            gitignore_files = [
+                f
+                for f in git_project_files(self.config.root)
+                if os.path.basename(f) == '.gitignore'
+            ]
+        except (OSError, CalledProcessError) as exc:
+            log.warning('Unable to list .gitignore files: %s', exc)
+            return
+
+        self.gitignore = GitIgnore.for_project(gitignore_files, self.config.root)
+
+    def path_changed(self, path):
+        # called from the watcher's thread
+        normalized_path = self.config.normalize_path(path)
+        if normalized_path is None:
+            log.debug('Ignoring path outside project: %s', path.strip())
+            return
+
+        if normalized_path == CONFIG_FILE or self.is_config_file(normalized_path):
+            # dealt with by dispatch_main, once it has stopped changing
+            self.files_queue.put(normalized_path)
+            return
+
+        if self.gitignore is not None:
+            if os.path.basename(normalized_path) == '.gitignore':
+                log.info('%s changed, reloading ignore rules', normalized_path)
+                self.load_gitignore()
+
+            if self.gitignore.is_ignored(normalized_path):
+                log.debug('Ignoring path ignored by git: %s', normalized_path)
+                return
+
+        if not self.is_monitored(normalized_path):
+            log.debug('Ignoring path: %s', normalized_path)
+            return
+
+        log.debug('Got another path: %s', normalized_path)
+        self.files_queue.put(normalized_path)
+
+    def known_files(self, directory):
+        """The files under a directory that the monitors have checked, say as it's moved away."""
+        normalized_directory = self.config.normalize_path(directory)
+        if normalized_directory is None:
+            return []
+
+        files = set()
+        for monitor_config in self.config.monitors.values():
+            files.update(self.stat_index(monitor_config).files_under(normalized_directory))
+        return [self.config.path(file) for file in sorted(files)]
 
     def run(self):
         # Doesn't return
-        self.start_fswatch()
+        self.query_server = QueryServer(self)
+        self.query_server.start()
+        self.start()
+        self.start_watcher()
+        self.start_reconcile()
 
         try:
-            while True:
-                next_files = self.get_next_files()
-                assert len(next_files)
-                log.info('Files changed:')
-                for file in next_files:
-                    log.info(f'  {file}')
-                self.update_sessions(next_files)
+            self.dispatch_main()
         except BaseException as exc:
             log.debug('Exiting due to exception %s', exc)
-            self.stop_fswatch()
+            self.stop()
+            self.stop_watcher()
+            self.query_server.stop()
             raise
+
+    def dispatch_main(self):
+        """Hand the changed files to the monitors' workers until we're stopped."""
+        while True:
+            next_files = self.get_next_files()
+            if next_files is None:
+                return
+
+            log.info('Files changed:')
+            for file in next_files:
+                log.info(f'  {file}')
+
+            if CONFIG_FILE in next_files:
+                self.reload_config()
+            if any(self.is_config_file(file) for file in next_files):
+                for worker in self.workers:
+                    if config_files_changed(worker.config):
+                        self.start_relint(worker)
+
+            files_by_monitor = self.router.files_by_monitor(next_files)
+            if self.import_graph is not None:
+                self.import_graph.update(next_files)
+                self.add_dependents(files_by_monitor)
+            for worker in self.workers:
+                worker_files = files_by_monitor[worker.config.name]
+                if len(worker_files) > 0:
+                    worker.add_files(worker_files)
+
+    # ----------------------------------------------------------------------------------------------
+    # Checking all files again
+    # ----------------------------------------------------------------------------------------------
+    def start_relint(self, worker):
+        # finding and ordering all the files can take a while, and the dispatcher should carry on
+        # meanwhile
+        Thread(target=self.relint, args=(worker,), name=f'relint-{worker}', daemon=True).start()
+
+    def relint(self, worker):
+        """Have a monitor whose config files have changed check all its files in the background.
+
+        Files with problems go first, as those are the ones whose results are shown, and then the
+        most recently modified, as those are the most likely to be edited again.
+        """
+        monitor_config = worker.config
+        config, router, _ = self.config_snapshot()
+        try:
+            all_files = find_all_appropriate_files(config)
+        except Exception:
+            log.exception('Failed to find the files for %s', monitor_config.name)
+            return
+        files = router.files_by_monitor(all_files).get(monitor_config.name, [])
+        files_with_problems = self.problem_store(monitor_config).files_with_problems()
+
+        def priority(file):
+            try:
+                mtime_ns = os.stat(config.path(file)).st_mtime_ns
+            except OSError:
+                mtime_ns = 0
+            return (file not in files_with_problems, -mtime_ns)
+
+        files.sort(key=priority)
+        log.info(
+            'The config files of %s have changed, checking all %d files again',
+            monitor_config.name,
+            len(files),
+        )
+        worker.relint(files)
+        with self.sessions_lock:
+            self.save_badge()
+
+    def relinted(self, monitor_config):
+        # called from the monitor workers' threads
+        write_checked_digests(monitor_config)
+
+    # ----------------------------------------------------------------------------------------------
+    # Reloading the config
+    # ----------------------------------------------------------------------------------------------
+    def reload_config(self):
+        """Switch to the config file as it is now, re-linting with only the monitors it changes.
+
+        Monitors whose command, worker, file_pattern or problem_line_file_pattern have changed, as
+        far as their problems depend on them, have their state dropped and check all their files
+        again, as do new monitors, and removed monitors' state is deleted. The other monitors
+        carry on with their state and any running session, just with their other options updated.
+        """
+        try:
+            config = load_config_file(self.config.path(CONFIG_FILE))
+        except BadConfig as exc:
+            log.error('Keeping the current config as %s is bad: %s', CONFIG_FILE, exc)
+            return
+
+        if config.mtime_ns == self.config.mtime_ns:
+            return
+
+        old_monitors = self.config.monitors
+        changed = [
+            name
+            for name, monitor_config in config.monitors.items()
+            if name not in old_monitors
+            or monitor_config.lint_key() != old_monitors[name].lint_key()
+        ]
+        removed = [name for name in old_monitors if name not in config.monitors]
+        log.info(
+            'Reloading %s: %s',
+            CONFIG_FILE,
+            ', '.join(
+                [f'{name} {"changed" if name in old_monitors else "added"}' for name in changed]
+                + [f'{name} removed' for name in removed]
+            )
+            or 'no monitors changed',
+        )
+        if config.watcher != self.config.watcher or config.concurrency != self.config.concurrency:
+            log.warning('Restart lintmond for changes to watcher and concurrency to take effect')
+
+        workers = {worker.config.name: worker for worker in self.workers}
+        for name in changed + removed:
+            if name in workers:
+                self.drop_monitor(workers.pop(name))
+
+        import_graph = self.import_graph
+        if not any(mc.scope == 'dependents' for mc in config.monitors.values()):
+            import_graph = None
+        elif import_graph is None:
+            import_graph = ImportGraph.for_project(config.root)
+        with self.config_lock:
+            self.config = config
+            self.router = FileRouter(config.monitors.values())
+            self.import_graph = import_graph
+        self.scheduler.config = config
+        if config.discovery != 'git':
+            self.gitignore = None
+        elif self.gitignore is None:
+            self.load_gitignore()
+
+        for name, worker in workers.items():
+            worker.config = config.monitors[name]
+        for name in changed:
+            workers[name] = self.new_worker(config.monitors[name])
+            workers[name].start()
+        self.workers = [workers[name] for name in config.monitors]
+
+        with self.sessions_lock:
+            sessions = {sess.config.name: sess for sess in self.sessions}
+            self.sessions = []
+            for monitor_config in config.monitors.values():
+                sess = sessions.get(monitor_config.name)
+                if sess is None or monitor_config.name in changed:
+                    sess = self.new_session(monitor_config, [])
+                    sess.skip()
+                else:
+                    # for its badge's colours
+                    sess.config = monitor_config
+                self.sessions.append(sess)
+            self.save_badge()
+
+        if len(changed) > 0:
+            # finding all the files can take a while, and the dispatcher should carry on meanwhile
+            Thread(
+                target=self.check_all_files,
+                args=(config, self.router, {name: workers[name] for name in changed}),
+                name='reload',
+                daemon=True,
+            ).start()
+
+    def check_all_files(self, config, router, workers):
+        """Have the workers of new and changed monitors, by name, check all the files."""
+        try:
+            files_by_monitor = router.files_by_monitor(find_all_appropriate_files(config))
+        except Exception:
+            log.exception('Failed to find the files for %s', ', '.join(workers))
+            return
+
+        for name, worker in workers.items():
+            log.info('Checking all %d files for %s', len(files_by_monitor[name]), name)
+            if len(files_by_monitor[name]) > 0:
+                worker.add_files(files_by_monitor[name])
+
+    def drop_monitor(self, worker):
+        """Stop a monitor that has been changed or removed, deleting its state."""
+        worker.stop()
+        self.delete_monitor_state(worker.config.name)
+
+    def drop_stale_monitors(self):
+        """Delete the state of monitors whose lint_key() changed while they weren't running.
+
+        Their stat indexes are then empty, so all their files count as changed.
+        """
+        for monitor_config in self.config.monitors.values():
+            if self.stat_index(monitor_config).is_stale():
+                log.info(
+                    '%s has changed since it last ran, checking all its files', monitor_config.name
+                )
+                self.delete_monitor_state(monitor_config.name)
+
+    def delete_monitor_state(self, name):
+        with self.stores_lock:
+            warm_worker = self.warm_workers.pop(name, None)
+            problem_store = self.problem_stores.pop(name, None)
+            self.result_caches.pop(name, None)
+            self.stat_indexes.pop(name, None)
+        if warm_worker is not None:
+            warm_worker.interrupt()
+            warm_worker.stop()
+        if problem_store is not None:
+            problem_store.close()
+        shutil.rmtree(self.config.path(STATE_DIR, 'monitors', name), ignore_errors=True)
@@ -0,0 +1,102 @@
+"""Timings and counts for each run of a monitor.
+
+Every saved session's metrics are written as a line of JSON to the `lintmon.metrics` logger, which
+lintmon's commands send to the rotating `.lintmon/metrics.jsonl` file, and lintmond also keeps the
+most recent sessions' in memory so that lintmon-stats can ask it for percentiles.
+
+Timings are in seconds:
+
+    queue_wait  from the files being handed to the monitor's worker until its session started
+    deferred    how much of that they were held back because the machine was busy
+    spawn       starting the command's processes
+    wall        from starting the first process until the end of the last one's output
+    cpu         user and system time of the processes (not available for warm workers)
+    parse       lintmond's CPU time reading and parsing the output
+    diff        working out which problems have changed
+    save        saving the problems, result cache and stat index
+    total       from the session starting until it was saved
+
+and counts are of the files given to the session, those the command was run on, those whose
+results were in the result cache, those skipped because they no longer exist, and the problems
+in all files once the session was saved.
+"""
+import json
+import logging
+from collections import deque
+from threading import Lock
+from time import time
+
+from .settings import METRICS_WINDOW
+
+
+log = logging.getLogger(__name__)
+
+TIMINGS = ('queue_wait', 'deferred', 'spawn', 'wall', 'cpu', 'parse', 'diff', 'save', 'total')
+COUNTS = ('files', 'files_run', 'cache_hits', 'skipped', 'problems')
+PERCENTILES = (50, 95, 99)
+
+
+def record_session(session, metrics_log=None):
+    """Log a saved session's metrics, returning them."""
+    metrics = {
+        'monitor': session.config.name,
+        'time': round(time(), 3),
+        **{name: round(value, 6) for name, value in session.metrics.items()},
+    }
+    (metrics_log or log).info(json.dumps(metrics))
+    return metrics
+
+
+class RollingMetrics:
+    """The metrics of each monitor's most recent sessions."""
+
+    @classmethod
+    def from_lines(cls, lines):
+        rolling = cls()
+        for line in lines:
+            try:
+                metrics = json.loads(line)
+                rolling.add(metrics)
+            except (ValueError, KeyError, TypeError):
+                continue
+        return rolling
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        # monitor -> metric -> deque of values
+        self.samples = {}
+        self.lock = Lock()
+
+    def add(self, metrics):
+        with self.lock:
+            monitor_samples = self.samples.setdefault(metrics['monitor'], {})
+            for name in TIMINGS + COUNTS:
+                value = metrics.get(name)
+                if value is None:
+                    continue
+                monitor_samples.setdefault(name, deque(maxlen=self.window)).append(value)
+
+    def percentiles(self):
+        """Return {monitor: {metric: {'count': n, 'p50': ..., 'p95': ..., 'p99': ...}}}."""
+        with self.lock:
+            samples = {
+                monitor: {name: sorted(values) for name, values in monitor_samples.items()}
+                for monitor, monitor_samples in self.samples.items()
+            }
+
+        return {
+            monitor: {
+                name: {
+                    'count': len(values),
+                    **{f'p{pct}': percentile(values, pct) for pct in PERCENTILES},
+                }
+                for name, values in monitor_samples.items()
+            }
+            for monitor, monitor_samples in samples.items()
+        }
+
+
+def percentile(sorted_values, pct):
+    # nearest rank
+    rank = -(-len(sorted_values) * pct // 100)
+    return sorted_values[max(0, rank - 1)]
@@ -1,10 +1,22 @@
 import logging
 import os
-from subprocess import Popen
-from tempfile import TemporaryFile
+import signal
+from subprocess import PIPE, STDOUT, Popen
+from threading import Lock, Thread
+from time import monotonic, sleep, thread_time
 
-from .settings import STATE_DIR
-from .utils import diff_problem_lines, gb
+from .linter_config import config_files_digests
+from .problem import Problem
+from .settings import (
+    CHUNK_MAX_BYTES,
+    CHUNK_MAX_FILES,
+    CHUNK_MIN_FILES,
+    OUTPUT_MAX_LINE_LENGTH,
+    RUNNING_POLL_SECONDS,
+)
+from .stat_index import stat_key
+from .utils import diff_problem_lines
+from .warm_worker import WarmWorkerError
 
 
 log = logging.getLogger(__name__)
@@ -15,33 +27,68 @@ class MonitorSession:
         initial = 'initial'
         running = 'running'
         complete = 'complete'
+        cancelled = 'cancelled'
 
     @property
     def badge(self):
-        num_problems = sum(len(lines) for lines in self.problem_lines.values())
-        return self.config.badge_for_number(num_problems)
+        return self.config.badge_for_number(self.num_problems)
 
-    @property
-    def dirpath(self):
-        return os.path.join(STATE_DIR, 'monitors', self.config.name)
-
-    @property
-    def problem_lines_filepath(self):
-        return os.path.join(self.dirpath, 'problem_lines')
-
-    def __init__(self, config, files):
+    def __init__(
+        self,
+        config,
+        files,
+        problem_store,
+        result_cache=None,
+        process_slots=None,
+        warm_worker=None,
+        stat_index=None,
+        scheduler=None,
+    ):
         self.state = self.States.initial
         self.config = config
         self.files = files
-        self.process = None
-        self.output_file = None
+        # the problems of every file as of the last session to complete
+        self.problem_store = problem_store
+        self.result_cache = result_cache
+        # shared between sessions to limit the total number of processes
+        self.process_slots = process_slots
+        # a long-lived process to send the files to, rather than running the command, which
+        # checks them on a thread of ours
+        self.warm_worker = warm_worker
+        self.worker_thread = None
+        # where to record the stats of the files as they were when we checked them
+        self.stat_index = stat_index
+        self.file_stats = {}
+        # to lower the priority of the processes we start
+        self.scheduler = scheduler
+        # the files are checked in chunks, each in a process of its own whose output is read by
+        # a thread of its own, and the files of chunks whose process failed aren't cached
+        self.pending_chunks = []
+        self.chunk_processes = []
+        self.failed_files = set()
+        # the problem lines found in the output so far, and how many weren't kept because of the
+        # limits on them
+        self.output_problem_lines = {}
+        self.num_output_problem_lines = 0
+        self.num_dropped_problem_lines = 0
+        self.output_lock = Lock()
+        self.errors = []
+        # the problems found in the files the session checked, and once it has been saved or
+        # skipped, the number of problems in all files
         self.problem_lines = None
-
-        self.initial_problem_lines = gb(
-            self._read_lines_filepath(self.problem_lines_filepath),
-            self.config.extract_file_from_problem_line,
-        )
-        log.debug('%s initial problem lines %s', self, self.initial_problem_lines)
+        self.num_problems = None
+        # results for files whose content we've linted before, and cache keys to store the
+        # results for the files we actually run on under
+        self.cached_problem_lines = {}
+        self.run_file_cache_keys = {}
+        # timings and counts for lintmon-stats (see metrics.py), only for sessions that run
+        self.metrics = {}
+        # whether this is part of checking all the monitor's files again in the background
+        self.background = False
+        self.queued_at = None
+        self.started_at = None
+        self.first_spawned_at = None
+        self.output_finished_at = None
 
     def start(self):
         assert self.state == self.States.initial
@@ -50,103 +97,420 @@ class MonitorSession:
             self.skip()
             return
 
-        files = [f for f in self.files if os.path.exists(f)]
+        self.started_at = monotonic()
+        if self.queued_at is not None:
+            self.metrics['queue_wait'] = self.started_at - self.queued_at
+        self.metrics.update(files=len(self.files), files_run=0, cache_hits=0, skipped=0)
+
+        if self.stat_index is not None:
+            self.file_stats = {f: stat_key(self.config.path(f)) for f in self.files}
+
+        files = [f for f in self.files if os.path.exists(self.config.path(f))]
+        self.metrics['skipped'] = len(self.files) - len(files)
 
         if len(files) == 0:
             # all files were deleted, so mark as clear
             self.problem_lines = {f: [] for f in self.files}
+            self._set_errors()
+            self.state = self.States.complete
+            return
+
+        files = self._files_not_in_result_cache(files)
+        self.metrics['cache_hits'] = len(self.cached_problem_lines)
+        self.metrics['files_run'] = len(files)
+        if len(files) == 0:
+            log.debug('%s has cached results for all files', self)
+            self.problem_lines = {f: [] for f in self.files}
+            self.problem_lines.update(self.cached_problem_lines)
+            self._set_errors()
             self.state = self.States.complete
             return
 
         self.state = self.States.running
-        log.debug('Starting %s on %d files', self.config.command, len(files))
-        self.output_file = TemporaryFile(mode='w+')
-        try:
-            self.process = Popen(
-                [*self.config.command, *files], stdout=self.output_file, stderr=self.output_file,
-            )
-        except Exception as exc:
-            self.problem_lines = {'.': [str(exc).replace('\n', ' ')]}
-            self.process = None
+        self.pending_chunks = self._chunk_files(files)
+        log.debug(
+            'Starting %s on %d files in %d runs',
+            self.config.command,
+            len(files),
+            len(self.pending_chunks),
+        )
+        self._start_chunks()
 
     def join(self):
         if self.state == self.States.complete:
             return
 
+        while not self.poll():
+            if len(self.chunk_processes) > 0:
+                process, reader, files = self.chunk_processes[0]
+                self._reap(process, block=True)
+                reader.join()
+            elif self.worker_thread is not None:
+                self.worker_thread.join()
+            else:
+                # waiting for other sessions to free up a process slot
+                sleep(RUNNING_POLL_SECONDS)
+
+    def poll(self):
+        """Progress the session's runs, and return whether it is complete."""
+        if self.state == self.States.complete:
+            return True
+
         assert self.state == self.States.running
-        if self.process is None:
-            self.state = self.States.complete
+        for process, reader, files in list(self.chunk_processes):
+            # the reader finishes once it has read all of the output
+            if not reader.is_alive() and self._reap(process) is not None:
+                self._finish_chunk(process, reader, files)
+        if self.worker_thread is not None and not self.worker_thread.is_alive():
+            self.worker_thread = None
+            self._release_process_slot()
+
+        self._start_chunks()
+        if (
+            len(self.pending_chunks) > 0
+            or len(self.chunk_processes) > 0
+            or self.worker_thread is not None
+        ):
+            return False
+
+        self._finish()
+        return True
+
+    def terminate(self):
+        """Stop the session without results, e.g. because they would already be out of date."""
+        if self.state == self.States.running:
+            log.debug('Terminating %s', self)
+            for process, reader, files in self.chunk_processes:
+                process.terminate()
+                process.wait()
+                reader.join()
+                self._release_process_slot()
+            self.chunk_processes = []
+            self.pending_chunks = []
+            if self.worker_thread is not None:
+                # the thread stops between chunks, or as the worker is killed during one
+                self.state = self.States.cancelled
+                self.warm_worker.interrupt()
+                self.worker_thread.join()
+                self.worker_thread = None
+                self._release_process_slot()
+
+        self.state = self.States.cancelled
+
+    def _chunk_files(self, files):
+        # split the files into runs that are each short enough to pass on the command line, and
+        # if there are enough files, into enough runs to use all the processes we're allowed
+        max_files = min(
+            CHUNK_MAX_FILES,
+            max(CHUNK_MIN_FILES, -(-len(files) // self.config.concurrency)),
+        )
+        max_bytes = CHUNK_MAX_BYTES - sum(len(os.fsencode(arg)) + 1 for arg in self.config.command)
+
+        chunks = [[]]
+        chunk_bytes = 0
+        for file in files:
+            file_bytes = len(os.fsencode(file)) + 1
+            if len(chunks[-1]) > 0 and (
+                len(chunks[-1]) >= max_files or chunk_bytes + file_bytes > max_bytes
+            ):
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(file)
+            chunk_bytes += file_bytes
+
+        return chunks
+
+    def _start_chunks(self):
+        if self.warm_worker is not None:
+            self._start_warm_worker_chunks()
+            return
+
+        while len(self.pending_chunks) > 0 and len(self.chunk_processes) < self.config.concurrency:
+            if self.process_slots is not None and not self.process_slots.acquire(blocking=False):
+                return
+
+            files = self.pending_chunks.pop(0)
+            spawn_started = monotonic()
+            if self.first_spawned_at is None:
+                self.first_spawned_at = spawn_started
+            try:
+                process = Popen(
+                    [*self.config.command, *files],
+                    stdout=PIPE,
+                    stderr=STDOUT,
+                    encoding='utf8',
+                    errors='replace',
+                    cwd=self.config.root or None,
+                )
+            except Exception as exc:
+                self._chunk_failed(files, str(exc).replace('\n', ' '))
+                self._release_process_slot()
+                continue
+
+            if self.scheduler is not None:
+                self.scheduler.prioritise(process.pid)
+            reader = Thread(
+                target=self._read_output,
+                args=(process.stdout,),
+                name=f'{self}-output',
+                daemon=True,
+            )
+            reader.start()
+            self.chunk_processes.append((process, reader, files))
+            self._add_metric('spawn', monotonic() - spawn_started)
+
+    def _start_warm_worker_chunks(self):
+        if len(self.pending_chunks) == 0 or self.worker_thread is not None:
+            return
+
+        # the worker counts as one of the processes we're allowed, while it's checking our files
+        if self.process_slots is not None and not self.process_slots.acquire(blocking=False):
+            return
+
+        chunks = self.pending_chunks
+        self.pending_chunks = []
+        self.worker_thread = Thread(
+            target=self._run_chunks_in_warm_worker,
+            args=(chunks,),
+            name=f'{self}-worker',
+            daemon=True,
+        )
+        self.worker_thread.start()
+
+    def _run_chunks_in_warm_worker(self, chunks):
+        started = monotonic()
+        parse_started = thread_time()
+        for files in chunks:
+            if self.state != self.States.running:
+                # terminated
+                return
+
+            try:
+                output, returncode = self.warm_worker.run(files)
+            except WarmWorkerError as exc:
+                if self.state != self.States.running:
+                    return
+                self._chunk_failed(files, str(exc))
+                continue
+
+            for line in output:
+                self._add_output_line(line)
+            error = self._exit_error(returncode)
+            if error is not None:
+                self._chunk_failed(files, error)
+        # the worker's CPU time isn't available, and while waiting for it we use next to none
+        self._add_metric('wall', monotonic() - started)
+        self._add_metric('parse', thread_time() - parse_started)
+
+    def _read_output(self, stream):
+        # overlong lines are read in pieces, which will almost certainly not be problem lines
+        started = thread_time()
+        with stream:
+            for line in iter(lambda: stream.readline(OUTPUT_MAX_LINE_LENGTH), ''):
+                self._add_output_line(line)
+        self._add_metric('parse', thread_time() - started)
+        # the process exits as its output ends, and this is sooner than we poll for it
+        with self.output_lock:
+            self.output_finished_at = monotonic()
+
+    def _add_output_line(self, line):
+        # lines that aren't about a file are dropped straight away, so however much output the
+        # command produces we only keep the limited number of problem lines
+        try:
+            problem = self.config.parse_problem_line(line.strip())
+        except Exception:
+            # rather than leave the rest of the output unread, and the command unable to finish
+            log.warning('%s: unable to parse output line %r', self, line, exc_info=True)
+            return
+
+        if problem is None:
             return
 
-        self.process.communicate()
-        self.output_file.flush()
-        self.output_file.seek(0)
-        olines = self.output_file.readlines()
-        log.debug('%s output lines: %s', self, olines)
-        self.problem_lines = gb(
-            (line.strip() for line in olines), self.config.extract_file_from_problem_line,
+        with self.output_lock:
+            if self.num_output_problem_lines >= self.config.max_problem_lines:
+                self.num_dropped_problem_lines += 1
+                return
+
+            file_problems = self.output_problem_lines.setdefault(problem.file, [])
+            if len(file_problems) >= self.config.max_problem_lines_per_file:
+                self.num_dropped_problem_lines += 1
+                return
+
+            file_problems.append(problem)
+            self.num_output_problem_lines += 1
+
+    def _finish_chunk(self, process, reader, files):
+        self.chunk_processes.remove((process, reader, files))
+        self._release_process_slot()
+        if len(self.chunk_processes) == 0 and len(self.pending_chunks) == 0:
+            self.metrics['wall'] = self.output_finished_at - self.first_spawned_at
+
+        # e.g. the linter crashed, or was killed for using too much memory, in which case its
+        # output may be incomplete
+        error = self._exit_error(process.returncode)
+        if error is not None:
+            self._chunk_failed(files, error)
+
+    def _chunk_failed(self, files, error):
+        log.warning('%s: %s', self, error)
+        self.errors.append(error)
+        self.failed_files.update(files)
+
+    def _reap(self, process, block=False):
+        # rather than leaving it to Popen, so that we get the process's resource usage
+        if process.returncode is not None:
+            return process.returncode
+
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            # already reaped
+            return process.poll()
+        if pid == 0:
+            return None
+
+        process.returncode = (
+            os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
         )
+        self._add_metric('cpu', rusage.ru_utime + rusage.ru_stime)
+        return process.returncode
+
+    def _add_metric(self, name, value):
+        # the output readers add to them from their own threads
+        with self.output_lock:
+            self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def _release_process_slot(self):
+        if self.process_slots is not None:
+            self.process_slots.release()
+
+    def _finish(self):
+        if self.num_dropped_problem_lines > 0:
+            log.warning(
+                '%s: kept %d problem lines, dropped %d over the limits',
+                self,
+                self.num_output_problem_lines,
+                self.num_dropped_problem_lines,
+            )
+
+        # the files of runs that failed keep the problems they had, since what output there was
+        # may be incomplete
+        self.problem_lines = {
+            file: lines
+            for file, lines in self.output_problem_lines.items()
+            if file not in self.failed_files
+        }
         # make sure we detect removal of problems by setting empty arrays for files that we
         # processed but didn't get output for
         for file in self.files:
-            self.problem_lines.setdefault(file, [])
-        self.output_file.close()
-        self.output_file = None
-        self.process = None
+            if file not in self.failed_files:
+                self.problem_lines.setdefault(file, [])
+        # with lines dropped, the results are incomplete, and the files ought to be checked again
+        if self.num_dropped_problem_lines == 0:
+            for file, key in self.run_file_cache_keys.items():
+                if file not in self.failed_files:
+                    self.result_cache.put(key, self.problem_lines[file])
+        self.problem_lines.update(self.cached_problem_lines)
+        self._set_errors()
+        self.output_problem_lines = {}
         self.state = self.States.complete
 
+    def _set_errors(self):
+        # errors running the command are reported in '.', which isn't one of the files, so it's
+        # cleared explicitly once the monitor runs without them
+        self.problem_lines['.'] = [Problem(err, '.') for err in dict.fromkeys(self.errors)]
+
+    def _exit_error(self, returncode):
+        """What went wrong running the command, or None if it exited as it should."""
+        if returncode < 0:
+            try:
+                signal_name = signal.Signals(-returncode).name
+            except ValueError:
+                signal_name = f'signal {-returncode}'
+            return f'{self.config.command[0]} was killed by {signal_name}'
+
+        if returncode not in self.config.ok_exit_codes:
+            return f'{self.config.command[0]} exited with status {returncode}'
+
+        return None
+
     def skip(self):
-        # don't bother running, just use initial values as end values
+        # don't bother running, just report the stored problems
         assert self.state == self.States.initial
-        self.problem_lines = self.initial_problem_lines
+        self.problem_lines = {}
+        self.num_problems = self.problem_store.num_problems
         self.state = self.States.complete
 
+    def all_problem_lines(self):
+        return self.problem_store.problem_lines()
+
     def save(self):
         # only able to save once it has been joined
         assert self.state == self.States.complete
         assert self.problem_lines is not None
 
-        new_problem_lines_by_file = {
-            **self.initial_problem_lines,
-            **self.problem_lines,
-        }
+        started = monotonic()
+        self._save_problem_lines()
+        if self.result_cache is not None:
+            self.result_cache.save()
+        if self.stat_index is not None:
+            self.stat_index.record(
+                {f: stat for f, stat in self.file_stats.items() if f not in self.failed_files}
+            )
 
-        log.debug('%s new_problem_lines_by_file %s', self, new_problem_lines_by_file)
+        if self.started_at is not None:
+            saved_at = monotonic()
+            self.metrics['save'] = saved_at - started - self.metrics.get('diff', 0)
+            self.metrics['total'] = saved_at - self.started_at
+            self.metrics['problems'] = self.num_problems
 
-        problem_line_diff = diff_problem_lines(
-            self.initial_problem_lines, new_problem_lines_by_file
-        )
+    def _save_problem_lines(self):
+        previous_problem_lines = self.problem_store.update(self.problem_lines)
+        self.num_problems = self.problem_store.num_problems
 
+        diff_started = monotonic()
+        problem_line_diff = diff_problem_lines(previous_problem_lines, self.problem_lines)
+        self.metrics['diff'] = monotonic() - diff_started
         if len(problem_line_diff) == 0:
-            log.debug('No change, no need to save %s', self)
+            log.debug('No change in %s', self)
             return
 
         log.info('Changes in %s:', self)
         for diff_entry in problem_line_diff:
             log.info('  %s %s', diff_entry[0], diff_entry[2])
 
-        expanded_sorted_lines = [
-            line
-            for file, lines in sorted(
-                new_problem_lines_by_file.items(), key=lambda k_v: k_v[0] or ''
-            )
-            for line in lines
-        ]
-
-        self._write_lines_filepath(self.problem_lines_filepath, expanded_sorted_lines)
-
     def __str__(self):
         return self.config.name
 
-    def _read_lines_filepath(self, filepath):
-        if not os.path.exists(filepath):
-            return []
+    def _files_not_in_result_cache(self, files):
+        # with the dependents scope, a file's problems depend on the files it imports as well as its
+        # own content, which is all the cache goes by
+        if (
+            self.result_cache is None
+            or self.config.result_cache_size == 0
+            or self.config.scope == 'dependents'
+        ):
+            return files
 
-        with open(filepath) as file:
-            return [self.config.normalize_path(line) for line in file.readlines()]
+        uncached_files = []
+        digests = config_files_digests(self.config)
+        for file in files:
+            key = self.result_cache.key_for_file(self.config, file, digests)
+            if key is None:
+                uncached_files.append(file)
+                continue
 
-    def _write_lines_filepath(self, filepath, problem_lines):
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w') as file:
-            for line in problem_lines:
-                print(line, file=file)
+            cached_lines = self.result_cache.get(key)
+            if cached_lines is None:
+                self.run_file_cache_keys[file] = key
+                uncached_files.append(file)
+            else:
+                self.cached_problem_lines[file] = cached_lines
+
+        log.debug(
+            '%s result cache: %d of %d files cached',
+            self,
+            len(self.cached_problem_lines),
+            len(files),
+        )
+        return uncached_files
@@ -0,0 +1,216 @@
+import logging
+from itertools import islice
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import monotonic
+
+from .settings import RELINT_CHUNK_FILES, RUNNING_POLL_SECONDS
+
+
+log = logging.getLogger(__name__)
+
+
+class MonitorWorker:
+    """Runs the daemon's sessions for one monitor on a thread of its own.
+
+    Each monitor having its own queue of changed files means its results are saved as soon as
+    they're ready, however long the other monitors take.
+
+    A worker runs at most one session at a time. Files that change while one is running are held
+    until it finishes, unless the session is already checking them, in which case its results
+    are out of date before they arrive so it is restarted with everything that has changed.
+
+    While the machine is busy, the scheduler may have the worker hold back large batches of files
+    too (see scheduling.py).
+
+    When all of the monitor's files are to be checked again, as its config files have changed,
+    they're checked in the background a chunk at a time while there's nothing else to check and
+    the machine isn't busy. Files that change meanwhile jump the queue, stopping the chunk being
+    checked if need be.
+    """
+
+    @property
+    def relinting(self):
+        return len(self.relint_files) > 0 or (self.session is not None and self.session.background)
+
+    def __init__(self, config, new_session, on_saved, scheduler=None, on_relinted=None):
+        self.config = config
+        self.new_session = new_session
+        self.on_saved = on_saved
+        self.scheduler = scheduler
+        self.on_relinted = on_relinted
+        self.files_queue = SimpleQueue()
+        self.session = None
+        self.pending_files = {}
+        # when the oldest of the pending files was queued, for the session's queue wait metric
+        self.pending_since = None
+        # when we started holding back the pending files because the machine is busy
+        self.deferred_since = None
+        # the files still to be checked again in the background, in the order to check them
+        self.relint_files = {}
+        self.relint_lock = Lock()
+        self.thread = Thread(target=self.main, name=f'monitor-{config.name}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.files_queue.put(None)
+        self.thread.join()
+
+    def add_files(self, files):
+        self.files_queue.put((files, monotonic()))
+
+    def relint(self, files):
+        """Check all of the files again in the background, in the order given."""
+        with self.relint_lock:
+            self.relint_files = dict.fromkeys(files)
+        # wake the worker up
+        self.files_queue.put(([], None))
+
+    def main(self):
+        while True:
+            try:
+                busy = (
+                    self.session is not None
+                    or len(self.pending_files) > 0
+                    or len(self.relint_files) > 0
+                )
+                item = self.files_queue.get(timeout=RUNNING_POLL_SECONDS if busy else None)
+            except Empty:
+                item = [], None
+
+            if item is None:
+                if self.session is not None:
+                    self.session.terminate()
+                return
+
+            files, queued_at = item
+            try:
+                if len(files) > 0:
+                    self.schedule(files, queued_at)
+                self.reap()
+            except Exception:
+                log.exception('%s worker failed', self)
+                if self.session is not None:
+                    self.session.terminate()
+                self.session = None
+
+    def schedule(self, files, queued_at):
+        with self.relint_lock:
+            for file in files:
+                self.relint_files.pop(file, None)
+
+        if self.session is not None and self.session.background:
+            # the chunk can be checked again once these have been
+            log.debug('Interrupting %s checking files again in the background', self)
+            self.session.terminate()
+            with self.relint_lock:
+                self.relint_files = {
+                    **dict.fromkeys(f for f in self.session.files if f not in files),
+                    **self.relint_files,
+                }
+            self.session = None
+
+        if self.session is None:
+            # any files already held back stay that way, rather than these being held with them
+            if self.should_defer(files, queued_at):
+                self.hold(files, queued_at)
+            else:
+                self.start_session(files, queued_at)
+            return
+
+        if set(self.session.files).isdisjoint(files):
+            self.hold(files, queued_at)
+            return
+
+        log.info('Restarting %s as its files have changed again', self.session)
+        self.session.terminate()
+        self.start_session(
+            list(
+                {
+                    **dict.fromkeys(self.session.files),
+                    **self.pending_files,
+                    **dict.fromkeys(files),
+                }
+            ),
+            queued_at if self.pending_since is None else self.pending_since,
+        )
+        self.pending_files = {}
+        self.pending_since = None
+        self.deferred_since = None
+
+    def hold(self, files, queued_at):
+        self.pending_files.update(dict.fromkeys(files))
+        if self.pending_since is None:
+            self.pending_since = queued_at
+
+    def should_defer(self, files, queued_at):
+        if self.scheduler is None:
+            return False
+
+        reason = self.scheduler.reason_to_defer(files, queued_at)
+        if reason is None:
+            return False
+
+        if self.deferred_since is None:
+            log.info('Deferring %s on %d files as %s', self, len(files), reason)
+            self.deferred_since = monotonic()
+        return True
+
+    def start_session(self, files, queued_at):
+        self.session = self.new_session(self.config, files)
+        self.session.queued_at = queued_at
+        self.session.start()
+
+    def reap(self):
+        if self.session is not None:
+            if not self.session.poll():
+                return
+
+            session = self.session
+            self.session = None
+            session.save()
+            self.on_saved(session)
+            if session.background and not self.relinting:
+                log.info('Finished checking all files for %s again', self)
+                if self.on_relinted is not None:
+                    self.on_relinted(self.config)
+
+        if len(self.pending_files) == 0:
+            self.start_relint_chunk()
+            return
+        if self.should_defer(self.pending_files, self.pending_since):
+            return
+
+        files = list(self.pending_files)
+        queued_at = self.pending_since
+        deferred_since = self.deferred_since
+        self.pending_files = {}
+        self.pending_since = None
+        self.deferred_since = None
+        if deferred_since is None:
+            self.start_session(files, queued_at)
+            return
+
+        deferred = monotonic() - deferred_since
+        log.info('Starting %s on %d files deferred for %.1fs', self, len(files), deferred)
+        self.start_session(files, queued_at)
+        self.session.metrics['deferred'] = deferred
+
+    def start_relint_chunk(self):
+        if self.session is not None or len(self.relint_files) == 0:
+            return
+        if self.scheduler is not None and self.scheduler.overloaded() is not None:
+            return
+
+        with self.relint_lock:
+            files = list(islice(self.relint_files, RELINT_CHUNK_FILES))
+            for file in files:
+                del self.relint_files[file]
+
+        self.start_session(files, None)
+        self.session.background = True
+
+    def __str__(self):
+        return self.config.name
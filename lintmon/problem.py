@@ -0,0 +1,45 @@
+import sys
+
+
+class Problem:
+    """A line of a monitor's output about a file, and what we could parse out of it.
+
+    There may be a great many of these in memory at once, hence the slots, and the interning of
+    the strings that they're likely to share with many others.
+    """
+
+    __slots__ = ('text', 'file', 'line', 'col', 'code', 'message')
+
+    FIELDS = ('file', 'line', 'col', 'code', 'message')
+
+    @classmethod
+    def from_json(cls, json_):
+        return cls(*json_)
+
+    def __init__(self, text, file, line=None, col=None, code=None, message=None):
+        self.text = text
+        self.file = sys.intern(file)
+        self.line = line
+        self.col = col
+        self.code = sys.intern(code) if code is not None else None
+        self.message = message
+
+    def to_json(self):
+        return [self.text, self.file, self.line, self.col, self.code, self.message]
+
+    def as_dict(self):
+        return {'text': self.text, **{field: getattr(self, field) for field in self.FIELDS}}
+
+    def __eq__(self, other):
+        if not isinstance(other, Problem):
+            return NotImplemented
+        return self.to_json() == other.to_json()
+
+    def __hash__(self):
+        return hash((self.text, self.file))
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.text!r})'
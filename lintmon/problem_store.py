@@ -0,0 +1,248 @@
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from threading import Lock
+
+from .problem import Problem
+from .settings import STATE_DIR
+from .utils import gb
+
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+PROBLEMS_TABLE = '''
+CREATE TABLE problems (
+    file TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    line INTEGER,
+    col INTEGER,
+    code TEXT,
+    message TEXT,
+    PRIMARY KEY (file, position)
+) WITHOUT ROWID
+'''
+TOTALS_TABLE = '''
+CREATE TABLE totals (
+    num_problems INTEGER NOT NULL,
+    pattern TEXT
+)
+'''
+PROBLEM_COLUMNS = 'text, file, line, col, code, message'
+
+
+class ProblemStore:
+    """The problems a monitor last reported for each file, in an SQLite database.
+
+    Each session only touches the rows of the files it checked, in a single transaction, and the
+    total number of problems is kept up to date alongside them so the badge doesn't need to look
+    at every row. The database is in WAL mode so that lintmond and lintmon-run-all or
+    lintmon-status can use it at the same time.
+
+    Problems are stored as parsed, so they can be loaded, filtered and counted without parsing
+    them again (unless the pattern they're parsed with changes). Stores created by earlier
+    versions of lintmon, whether in a `problem_lines` text file or holding only the text of each
+    problem, are migrated the first time they're opened.
+    """
+
+    @classmethod
+    def for_monitor(cls, config):
+        dirpath = config.path(STATE_DIR, 'monitors', config.name)
+        return cls(
+            os.path.join(dirpath, 'problems.db'),
+            legacy_filepath=os.path.join(dirpath, 'problem_lines'),
+            parse_problem_line=config.parse_problem_line,
+            pattern=config.problem_line_file_regex and config.problem_line_file_regex.pattern,
+        )
+
+    def __init__(self, filepath, legacy_filepath=None, parse_problem_line=None, pattern=None):
+        self.filepath = filepath
+        self.legacy_filepath = legacy_filepath
+        self.parse_problem_line = parse_problem_line
+        self.pattern = pattern
+        self.connection = None
+        # sessions for a monitor may run on a different thread to the one that opened the store
+        self.lock = Lock()
+
+    @property
+    def num_problems(self):
+        with self.lock:
+            self._ensure_open()
+            (num_problems,) = self.connection.execute('SELECT num_problems FROM totals').fetchone()
+        return num_problems
+
+    def problem_lines(self, files=None):
+        """Return {file: [Problem]} for the files, or for all files with problems."""
+        with self.lock:
+            self._ensure_open()
+            if files is None:
+                problem_lines = {}
+                for row in self.connection.execute(
+                    f'SELECT {PROBLEM_COLUMNS} FROM problems ORDER BY file, position'
+                ):
+                    problem = Problem(*row)
+                    problem_lines.setdefault(problem.file, []).append(problem)
+                return problem_lines
+
+            return {file: self._file_lines(file) for file in files}
+
+    def files_with_problems(self):
+        with self.lock:
+            self._ensure_open()
+            rows = self.connection.execute('SELECT DISTINCT file FROM problems')
+            return {file for (file,) in rows}
+
+    def update(self, problem_lines_by_file):
+        """Replace the problem lines of the files, returning the ones they had before.
+
+        Nothing is written if none of the files' problems have changed.
+        """
+        with self.lock:
+            self._ensure_open()
+            with self._transaction():
+                previous = {file: self._file_lines(file) for file in problem_lines_by_file}
+                changed = {
+                    file: lines
+                    for file, lines in problem_lines_by_file.items()
+                    if lines != previous[file]
+                }
+                if len(changed) > 0:
+                    self._replace(changed)
+
+        return previous
+
+    def __str__(self):
+        return self.filepath
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _file_lines(self, file):
+        rows = self.connection.execute(
+            f'SELECT {PROBLEM_COLUMNS} FROM problems WHERE file = ? ORDER BY position', (file,)
+        )
+        return [Problem(*row) for row in rows]
+
+    def _replace(self, problem_lines_by_file):
+        num_deleted = 0
+        for file in problem_lines_by_file:
+            num_deleted += self.connection.execute(
+                'DELETE FROM problems WHERE file = ?', (file,)
+            ).rowcount
+
+        rows = [
+            (file, position, p.text, p.line, p.col, p.code, p.message)
+            for file, problems in problem_lines_by_file.items()
+            for position, p in enumerate(problems)
+        ]
+        self.connection.executemany('INSERT INTO problems VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self.connection.execute(
+            'UPDATE totals SET num_problems = num_problems + ?', (len(rows) - num_deleted,)
+        )
+
+    def _ensure_open(self):
+        if self.connection is not None:
+            return
+
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        # transactions are begun explicitly, see _transaction
+        self.connection = sqlite3.connect(
+            self.filepath, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        if self._is_current():
+            return
+
+        migrated = False
+        with self._transaction():
+            (version,) = self.connection.execute('PRAGMA user_version').fetchone()
+            if version > SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(
+                    f'{self.filepath} has schema version {version}, expected {SCHEMA_VERSION}'
+                )
+
+            if version == 0:
+                log.debug('Creating %s', self.filepath)
+                self.connection.execute(PROBLEMS_TABLE)
+                self.connection.execute(TOTALS_TABLE)
+                self.connection.execute('INSERT INTO totals VALUES (0, ?)', (self.pattern,))
+                migrated = self._migrate_legacy_file()
+            elif version == 1:
+                self._migrate_unparsed_problems()
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+            if not self._is_current():
+                self._reparse_problems()
+
+        if migrated:
+            os.remove(self.legacy_filepath)
+
+    def _is_current(self):
+        (version,) = self.connection.execute('PRAGMA user_version').fetchone()
+        if version != SCHEMA_VERSION:
+            return False
+
+        (pattern,) = self.connection.execute('SELECT pattern FROM totals').fetchone()
+        return pattern == self.pattern
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE so that another process can't write between our reads and our writes
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def _migrate_legacy_file(self):
+        if self.legacy_filepath is None or not os.path.exists(self.legacy_filepath):
+            return False
+
+        log.info('Migrating %s to %s', self.legacy_filepath, self.filepath)
+        with open(self.legacy_filepath) as file:
+            problems = [self._parse(line.strip()) for line in file]
+        self._replace(gb((p for p in problems if p is not None), lambda p: p.file))
+        return True
+
+    def _migrate_unparsed_problems(self):
+        # version 1 stored just the text of each problem, so move it across for _reparse_problems
+        self.connection.execute('ALTER TABLE problems RENAME TO unparsed_problems')
+        self.connection.execute(PROBLEMS_TABLE)
+        self.connection.execute(
+            'INSERT INTO problems (file, position, text) '
+            'SELECT file, position, line FROM unparsed_problems'
+        )
+        self.connection.execute('DROP TABLE unparsed_problems')
+        self.connection.execute('ALTER TABLE totals ADD COLUMN pattern TEXT')
+
+    def _reparse_problems(self):
+        log.info('Parsing the problems in %s with the current problem_line_file_pattern', self)
+        rows = []
+        for text, file, position in self.connection.execute(
+            'SELECT text, file, position FROM problems'
+        ):
+            problem = self._parse(text)
+            if problem is None or problem.file != file:
+                # the problem isn't about the same file according to the new pattern, but keep it
+                # where it is until the file is checked again
+                problem = Problem(text, file)
+            rows.append((problem.line, problem.col, problem.code, problem.message, file, position))
+        self.connection.executemany(
+            'UPDATE problems SET line = ?, col = ?, code = ?, message = ? '
+            'WHERE file = ? AND position = ?',
+            rows,
+        )
+        self.connection.execute('UPDATE totals SET pattern = ?', (self.pattern,))
+
+    def _parse(self, text):
+        if self.parse_problem_line is None:
+            return None
+        return self.parse_problem_line(text)
@@ -0,0 +1,202 @@
+"""Entry point for lintmon-status-prompt.
+
+This runs on every render of the user's shell prompt, so the common path (lintmond is running and
+has written an up to date badge file) must only touch the few modules imported here. Anything
+heavier, such as PyYAML, subprocess, logging or even typing, is imported only once we know we
+need it.
+
+Keep the import time of this module within the budget checked by benchmarks/import_time.py.
+"""
+import os
+
+from .badge import config_mtime_ns, read_badge
+from .settings import (
+    CONFIG_FILE,
+    PID_FILE,
+    PROMPT_QUERY_TIMEOUT_SECONDS,
+    QUERY_TIMEOUT_SECONDS,
+    SHARED_ENV_VAR,
+    SHARED_PID_FILE,
+    SHARED_SOCKET_FILE,
+    SHARED_STATE_DIR,
+    SOCKET_FILE,
+    STATE_DIR,
+    STOP_FILE,
+)
+from .utils import colour_text
+
+
+# --------------------------------------------------------------------------------------------------
+# Entry points
+# --------------------------------------------------------------------------------------------------
+def status_prompt():
+    if not is_here():
+        return
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+
+    if is_stopped():
+        print(colour_text(' S ', background='red', foreground='white'), end='')
+        return
+
+    # if lintmond answers, it's running and has the freshest badge
+    badge = query_badge()
+    if badge is not None:
+        print(badge, end='')
+        return
+
+    # lintmond didn't answer in time for the badge, so don't wait on it any longer to check it's up
+    ensure_lintmon_is_running(timeout=PROMPT_QUERY_TIMEOUT_SECONDS)
+
+    badge = read_badge()
+    if badge is not None:
+        print(badge, end='')
+        return
+
+    # no up to date badge, so fall back to calculating it from the config and saved state
+    from .cli import status_prompt_from_state
+
+    return status_prompt_from_state()
+
+
+# --------------------------------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------------------------------
+def is_here():
+    return os.path.exists(CONFIG_FILE)
+
+
+def is_stopped():
+    return os.path.exists(STOP_FILE)
+
+
+def is_shared():
+    return bool(os.environ.get(SHARED_ENV_VAR))
+
+
+def daemon_address():
+    """The socket of the lintmond serving this project, and the root to tell it if it's shared."""
+    if is_shared():
+        return SHARED_SOCKET_FILE, os.getcwd()
+    return SOCKET_FILE, None
+
+
+def pid_file():
+    return SHARED_PID_FILE if is_shared() else PID_FILE
+
+
+def lintmon_pid():
+    try:
+        with open(pid_file()) as pf:
+            pid_line = pf.readline().strip()
+    except FileNotFoundError:
+        return None
+
+    if not pid_line.isdigit():
+        return None
+
+    pid = int(pid_line)
+    if not pid_exists(pid):
+        os.remove(pid_file())
+        return None
+
+    return pid
+
+
+def lintmon_is_running(timeout=QUERY_TIMEOUT_SECONDS):
+    # lintmond may not be answering queries yet if it has only just been started, and a pid file
+    # is much quicker to check anyway
+    return lintmon_pid() is not None or ping_lintmond(timeout) is not None
+
+
+def request_line(query):
+    """A request with no arguments, saying which project it's about if lintmond is shared."""
+    _, root = daemon_address()
+    if root is None:
+        return f'{{"query": "{query}"}}\n'.encode('utf8')
+    return f'{{"query": "{query}", "root": {json_string(root)}}}\n'.encode('utf8')
+
+
+def json_string(text):
+    # json itself is too slow to import, and paths seldom need more than this
+    escaped = ''.join(c if c >= ' ' and c not in '"\\' else f'\\u{ord(c):04x}' for c in text)
+    return f'"{escaped}"'
+
+
+def query_lintmond(request_line, timeout=QUERY_TIMEOUT_SECONDS):
+    """Send a request to lintmond's query socket and return its reply, or None if no answer."""
+    # the socket module proper is slow to import, as it pulls in enum and selectors
+    import _socket
+
+    socket_file, _ = daemon_address()
+
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    reply = b''
+    try:
+        sock.connect(socket_file)
+        sock.sendall(request_line)
+        while not reply.endswith(b'\n'):
+            data = sock.recv(4096)
+            if data == b'':
+                return None
+            reply += data
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+    return reply[:-1].decode('utf8')
+
+
+def ping_lintmond(timeout=QUERY_TIMEOUT_SECONDS):
+    """Return lintmond's reply to a ping, which includes its pid, or None if it doesn't answer."""
+    # without the root, so that the shared lintmond needn't register the project to answer
+    return query_lintmond(b'{"query": "ping"}\n', timeout)
+
+
+def query_badge():
+    """Return lintmond's badge, or None if it doesn't answer or its config is out of date."""
+    reply = query_lintmond(request_line('badge'), timeout=PROMPT_QUERY_TIMEOUT_SECONDS)
+    if reply is None:
+        return None
+
+    stamp, _, badge = reply.partition(' ')
+    if stamp != str(config_mtime_ns()):
+        return None
+
+    return badge
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists but belongs to someone else
+        return True
+    return True
+
+
+def run_lintmond():
+    from subprocess import DEVNULL, Popen
+
+    args = ['lintmond', '--quiet']
+    if is_shared():
+        # it's started from this project, and registers others as it's asked about them
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        args += ['--shared', '--root', os.getcwd()]
+
+    print('Starting lintmond...')
+    proc = Popen(args, stdin=DEVNULL, stderr=DEVNULL, stdout=DEVNULL)
+
+    with open(pid_file(), 'w') as pf:
+        pf.write(str(proc.pid))
+
+
+def ensure_lintmon_is_running(timeout=QUERY_TIMEOUT_SECONDS):
+    if lintmon_is_running(timeout):
+        return
+
+    run_lintmond()
@@ -0,0 +1,289 @@
+"""lintmond's query API, served on a Unix domain socket in the state directory.
+
+Clients send requests as lines of JSON objects, each with a `query` and any arguments, and get a
+line of JSON back for each:
+
+    {"query": "ping"}                       {"pid": 1234}
+    {"query": "count"}                      {"total": 3, "monitors": {"flake8": 3}, "running": {}}
+    {"query": "problems", "files": [...]}   {"problems": {"flake8": {"a.py": [{"text": ...}]}}}
+    {"query": "health"}                     {"pid": 1234, "uptime_seconds": ..., ...}
+    {"query": "stats"}                      {"monitors": {"flake8": {"wall": {"p50": ...}}}}
+    {"query": "subscribe"}                  {"subscribed": true}, then an event per saved session
+
+The exception is `badge`, which is answered with the mtime of the config the badge was computed
+with, a space and the badge itself (as in the badge file), so that lintmon-status-prompt needn't
+import json. Omitting `files` from `problems` gets the problems of all files. Each problem has the
+`text` of the line of output it came from, and its `file`, `line`, `col`, `code` and `message`
+as far as the monitor's problem_line_file_pattern picks them out (otherwise null). A subscriber
+that stops reading its events is disconnected once SUBSCRIBER_MAX_EVENTS of them are waiting.
+
+The shared lintmond (see shared_daemon.py) answers the same queries on a socket of its own for
+any of the user's projects, each request giving the project's directory as `root`, e.g.
+`{"query": "count", "root": "/home/me/project"}`.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+from queue import Full, Queue
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Lock, Thread
+from time import time
+
+from .settings import QUERY_TIMEOUT_SECONDS, SOCKET_FILE, SUBSCRIBER_MAX_EVENTS
+
+
+log = logging.getLogger(__name__)
+
+
+class QueryServer:
+    """Answers queries from the daemon's in-memory state on threads of its own."""
+
+    def __init__(self, lintmon, socket_file=SOCKET_FILE):
+        self.lintmon = lintmon
+        self.socket_file = socket_file
+        self.server = None
+        self.started_at = time()
+        self.subscribers = []
+        self.subscribers_lock = Lock()
+
+    def start(self):
+        if os.path.exists(self.socket_file):
+            if socket_is_live(self.socket_file):
+                log.error('Another lintmond is answering queries on %s, exiting', self.socket_file)
+                sys.exit(1)
+            # left behind by a lintmond that was killed, and would stop us binding
+            os.remove(self.socket_file)
+
+        self.server = ThreadingUnixStreamServer(self.socket_file, QueryHandler)
+        self.server.daemon_threads = True
+        self.server.query_server = self
+        log.info('Answering queries on %s', self.socket_file)
+        Thread(target=self.server.serve_forever, name='query-server', daemon=True).start()
+
+    def stop(self):
+        if self.server is None:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.remove(self.socket_file)
+        except FileNotFoundError:
+            pass
+
+    def server_for(self, request):
+        """The query server to answer the request, or None if there's none for its project."""
+        # only the shared lintmond needs to be told which project a request is about
+        request.pop('root', None)
+        return self
+
+    def answer(self, request):
+        query = getattr(self, f'query_{request.get("query")}', None)
+        if query is None:
+            return {'error': f'Unknown query {request.get("query")!r}'}
+
+        args = {k: v for k, v in request.items() if k != 'query'}
+        try:
+            return query(**args)
+        except TypeError as exc:
+            return {'error': f'Bad arguments: {exc}'}
+
+    def publish(self, event):
+        """Queue an event for every subscriber, dropping those that have gone or fallen behind."""
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+
+        # this is called from the monitor workers' threads, so mustn't wait on slow subscribers
+        for handler in subscribers:
+            if not handler.queue_event(event):
+                self.unsubscribe(handler)
+
+    def subscribe(self, handler):
+        with self.subscribers_lock:
+            self.subscribers.append(handler)
+
+    def unsubscribe(self, handler):
+        with self.subscribers_lock:
+            if handler in self.subscribers:
+                self.subscribers.remove(handler)
+
+    # ----------------------------------------------------------------------------------------------
+    # Queries
+    # ----------------------------------------------------------------------------------------------
+    def query_ping(self):
+        return {'pid': os.getpid()}
+
+    def query_badge(self):
+        with self.lintmon.sessions_lock:
+            return f'{self.lintmon.config.mtime_ns} {self.lintmon.badges}'
+
+    def query_count(self):
+        with self.lintmon.sessions_lock:
+            counts = {str(sess): sess.num_problems for sess in self.lintmon.sessions}
+        # the problems found so far in the files being checked, for monitors that are running
+        running = {}
+        for worker in self.lintmon.workers:
+            session = worker.session
+            if session is not None:
+                running[str(worker)] = session.num_output_problem_lines
+        return {'total': sum(counts.values()), 'monitors': counts, 'running': running}
+
+    def query_problems(self, files=None):
+        if files is not None:
+            files = [f for f in map(self.lintmon.config.normalize_path, files) if f is not None]
+
+        problems = {}
+        for monitor_config in self.lintmon.config.monitors.values():
+            monitor_files = None
+            if files is not None:
+                monitor_files = [
+                    f for f in files if monitor_config.name in self.lintmon.router.route(f)
+                ]
+            store = self.lintmon.problem_store(monitor_config)
+            problems[monitor_config.name] = {
+                file: [p.as_dict() for p in file_problems]
+                for file, file_problems in store.problem_lines(monitor_files).items()
+            }
+        return {'problems': problems}
+
+    def query_stats(self):
+        return {'monitors': self.lintmon.metrics.percentiles()}
+
+    def query_health(self):
+        watcher = self.lintmon.watcher
+        return {
+            'pid': os.getpid(),
+            'uptime_seconds': time() - self.started_at,
+            'watcher': {
+                'name': type(watcher).__name__ if watcher is not None else None,
+                'alive': watcher is not None and watcher.thread.is_alive(),
+            },
+            'monitors': {
+                str(worker): {
+                    'alive': worker.thread.is_alive(),
+                    'running': worker.session is not None,
+                    'pending_files': len(worker.pending_files),
+                    'deferred': worker.deferred_since is not None,
+                    # left to check again as the monitor's config files changed
+                    'relint_files': len(worker.relint_files),
+                }
+                for worker in self.lintmon.workers
+            },
+            'subscribers': len(self.subscribers),
+            # why batches that aren't urgent are being held back, if they are
+            'overloaded': self.lintmon.scheduler.overloaded(),
+        }
+
+
+def socket_is_live(socket_file):
+    """Whether a lintmond is listening on the socket, rather than it being left behind."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(QUERY_TIMEOUT_SECONDS)
+        try:
+            sock.connect(socket_file)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        except OSError as exc:
+            # say it's timed out: something is there, and it isn't ours to take over
+            log.warning('Unable to connect to %s: %s', socket_file, exc)
+            return True
+
+        try:
+            sock.sendall(b'{"query": "ping"}\n')
+            log.info('lintmond answered on %s: %s', socket_file, sock.makefile().readline().strip())
+        except OSError:
+            pass
+        return True
+
+
+class QueryHandler(StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # subscribers are also written to from their event writer threads
+        self.write_lock = Lock()
+        # the events waiting to be written to a subscriber, which is writing them if it isn't None
+        self.events = None
+        self.gone = False
+
+    def handle(self):
+        subscribed_to = []
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('expected an object')
+                except ValueError as exc:
+                    self.send({'error': f'Bad request: {exc}'})
+                    continue
+
+                query_server = self.server.query_server.server_for(request)
+                if query_server is None:
+                    self.send({'error': 'Not a lintmon project'})
+                    continue
+
+                if request.get('query') == 'subscribe':
+                    self.start_writing_events()
+                    query_server.subscribe(self)
+                    subscribed_to.append(query_server)
+                    self.send({'subscribed': True})
+                    continue
+
+                if not self.send(query_server.answer(request)):
+                    return
+        finally:
+            for query_server in subscribed_to:
+                query_server.unsubscribe(self)
+            self.gone = True
+            if self.events is not None:
+                try:
+                    # for write_events
+                    self.events.put_nowait(None)
+                except Full:
+                    # it's bound to fail writing one of those, as the connection is closing
+                    pass
+
+    def send(self, response):
+        """Write a response line, returning whether the client is still there to read it."""
+        line = response if isinstance(response, str) else json.dumps(response)
+        try:
+            with self.write_lock:
+                self.wfile.write(f'{line}\n'.encode('utf8'))
+                self.wfile.flush()
+        except OSError:
+            return False
+        return True
+
+    def start_writing_events(self):
+        if self.events is not None:
+            return
+
+        self.events = Queue(SUBSCRIBER_MAX_EVENTS)
+        Thread(target=self.write_events, name='query-subscriber', daemon=True).start()
+
+    def queue_event(self, event):
+        """Queue an event to be sent, returning whether the subscriber is keeping up."""
+        if self.gone:
+            return False
+
+        try:
+            self.events.put_nowait(event)
+        except Full:
+            log.warning('Dropping a subscriber that has stopped reading events')
+            self.gone = True
+            try:
+                # so that the client sees it's been dropped, and handle() ends
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def write_events(self):
+        while True:
+            event = self.events.get()
+            if event is None or not self.send(event):
+                self.gone = True
+                return
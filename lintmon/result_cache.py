@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+from .problem import Problem
+from .settings import STATE_DIR
+from .utils import file_digest, write_file_atomic
+
+
+log = logging.getLogger(__name__)
+
+# part of every key, so that entries in an old format are never used
+FORMAT_VERSION = 2
+
+# lookups alone don't change which results are cached, only the hit counts and the LRU order, so
+# they are only written out with the next change or after this many of them
+LOOKUPS_PER_SAVE = 1000
+
+
+class ResultCache:
+    """Persistent LRU cache of the problems a monitor's command found in a file.
+
+    Entries are keyed on the command and the pattern its output is parsed with, the file's path
+    (which appears in the problem lines) and a hash of the file's content, so a file that has
+    been touched without changing needn't be linted again. For monitors with config_files, the
+    hashes of those are part of the key too.
+    """
+
+    @classmethod
+    def for_monitor(cls, config):
+        return cls(
+            config.path(STATE_DIR, 'monitors', config.name, 'result_cache.json'),
+            config.result_cache_size,
+        )
+
+    def __init__(self, filepath, max_entries):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = None
+        self.dirty = False
+        self.unsaved_lookups = 0
+
+    def key_for_file(self, config, filepath, config_files_digests=None):
+        try:
+            digest = file_digest(config.path(filepath))
+        except OSError:
+            return None
+
+        pattern = config.problem_line_file_regex and config.problem_line_file_regex.pattern
+        key = [FORMAT_VERSION, config.command, pattern, filepath, digest]
+        if config_files_digests:
+            key.append(config_files_digests)
+        return hashlib.sha1(json.dumps(key).encode('utf8')).hexdigest()
+
+    def get(self, key):
+        self._ensure_loaded()
+        problems = self.entries.get(key)
+        if problems is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        self.unsaved_lookups += 1
+        return None if problems is None else [Problem.from_json(p) for p in problems]
+
+    def put(self, key, problems):
+        self._ensure_loaded()
+        self.entries[key] = [p.to_json() for p in problems]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty and self.unsaved_lookups < LOOKUPS_PER_SAVE:
+            return
+
+        write_file_atomic(
+            self.filepath,
+            json.dumps(
+                {'hits': self.hits, 'misses': self.misses, 'entries': list(self.entries.items())}
+            ),
+        )
+        self.dirty = False
+        self.unsaved_lookups = 0
+
+    def __str__(self):
+        self._ensure_loaded()
+        return f'{len(self.entries)} entries, {self.hits} hits, {self.misses} misses'
+
+    def _ensure_loaded(self):
+        if self.entries is not None:
+            return
+
+        self.entries = OrderedDict()
+        try:
+            with open(self.filepath) as file:
+                saved = json.load(file)
+            self.entries.update(saved['entries'])
+            self.hits = saved['hits']
+            self.misses = saved['misses']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.warning('Ignoring unreadable result cache %s: %s', self.filepath, exc)
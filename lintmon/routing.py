@@ -0,0 +1,95 @@
+import os
+import re
+
+
+# file_patterns that just match a file extension (or one of several), e.g. `.*\.py$`, which can
+# be looked up by the file's suffix rather than matched as a regex
+SUFFIX_PATTERN_REGEX = re.compile(
+    r'^(?:\^?\.\*)?\\\.(?:(?P<suffix>\w+)|\((?:\?:)?(?P<suffixes>\w+(?:\|\w+)*)\))\$$'
+)
+
+
+def suffixes_for_pattern(pattern):
+    """Return the suffixes a file_pattern matches, or None if it's not that simple."""
+    mo = SUFFIX_PATTERN_REGEX.match(pattern)
+    if mo is None:
+        return None
+
+    names = mo.group('suffix') or mo.group('suffixes')
+    # file_patterns are case insensitive
+    return tuple(f'.{name.lower()}' for name in names.split('|'))
+
+
+class FileRouter:
+    """Works out which monitors want which files, looking at each path once.
+
+    Monitors without a file_pattern want everything, and those whose file_pattern is just a
+    suffix are looked up by suffix. The patterns of any others are combined into a single regex
+    so that we only test them individually for files that at least one of them wants.
+
+    Routes are remembered per path, as the daemon sees the same paths over and over.
+    """
+
+    def __init__(self, monitor_configs):
+        self.monitor_names = [mc.name for mc in monitor_configs]
+        self.all_files_monitors = []
+        self.suffix_monitors = {}
+        self.regex_monitors = []
+        for mc in monitor_configs:
+            if mc.file_regex is None:
+                self.all_files_monitors.append(mc.name)
+                continue
+
+            suffixes = suffixes_for_pattern(mc.file_regex.pattern)
+            if suffixes is None:
+                self.regex_monitors.append(mc)
+                continue
+
+            for suffix in suffixes:
+                self.suffix_monitors.setdefault(suffix, []).append(mc.name)
+
+        self.combined_regex = None
+        if len(self.regex_monitors) > 1:
+            try:
+                self.combined_regex = re.compile(
+                    '|'.join(f'(?:{mc.file_regex.pattern})' for mc in self.regex_monitors),
+                    re.IGNORECASE,
+                )
+            except re.error:
+                # e.g. the patterns use backreferences, which can't simply be combined
+                pass
+
+        self.routes = {}
+
+    def route(self, path):
+        """Return the names of the monitors that want the file, in config order."""
+        try:
+            return self.routes[path]
+        except KeyError:
+            pass
+
+        filename = path.rpartition(os.sep)[2]
+        names = set(self.all_files_monitors)
+
+        lower_filename = filename.lower()
+        dot_index = lower_filename.find('.')
+        while dot_index != -1:
+            names.update(self.suffix_monitors.get(lower_filename[dot_index:], ()))
+            dot_index = lower_filename.find('.', dot_index + 1)
+
+        if self.combined_regex is None or self.combined_regex.search(filename):
+            names.update(
+                mc.name for mc in self.regex_monitors if mc.file_regex.search(filename)
+            )
+
+        route = tuple(name for name in self.monitor_names if name in names)
+        self.routes[path] = route
+        return route
+
+    def files_by_monitor(self, files):
+        """Return {monitor name: [files it wants]} for all monitors."""
+        files_by_monitor = {name: [] for name in self.monitor_names}
+        for file in files:
+            for name in self.route(file):
+                files_by_monitor[name].append(file)
+        return files_by_monitor
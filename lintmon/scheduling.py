@@ -0,0 +1,113 @@
+"""Keeping lintmond's linting in the background of whatever else the machine is doing.
+
+The linters are started at a lower CPU and IO priority (the `nice` and `io_priority` options), and
+batches of files that aren't urgent, i.e. have more than `urgent_max_files` files, as after a
+checkout or rebase, are held back while the machine is busy: while the load average per CPU is
+over `max_load`, or our linters are using more than `max_linter_cpu` percent of all the CPUs.
+Batches aren't held back for more than `max_defer_seconds`, so their results arrive eventually.
+
+The total number of linter processes is limited separately, by the `concurrency` option.
+"""
+import logging
+import os
+from threading import Lock
+from time import monotonic
+
+import psutil
+
+from .settings import LOAD_CHECK_SECONDS
+
+
+log = logging.getLogger(__name__)
+
+
+def io_priority_args(name):
+    """The arguments to psutil's ionice for an io_priority, or None to leave it as it is."""
+    if name == 'low':
+        return (getattr(psutil, 'IOPRIO_CLASS_BE', None), 7)
+    if name == 'idle':
+        return (getattr(psutil, 'IOPRIO_CLASS_IDLE', None), None)
+    return None
+
+
+class Scheduler:
+    def __init__(self, config):
+        self.config = config
+        self.cpus = os.cpu_count() or 1
+        # our child processes, kept between checks as psutil measures their CPU use since the last
+        self.children = {}
+        self.checked_at = None
+        self.overload = None
+        self.lock = Lock()
+
+    def prioritise(self, pid):
+        """Lower the CPU and IO priority of a linter process we've just started.
+
+        This is done from here rather than in the child before it execs, which isn't safe in a
+        process with threads, so anything the linter starts in its first moments is missed.
+        """
+        try:
+            process = psutil.Process(pid)
+            if self.config.nice > 0:
+                process.nice(self.config.nice)
+            ionice_args = io_priority_args(self.config.io_priority)
+            if ionice_args is not None and ionice_args[0] is not None:
+                process.ionice(*ionice_args)
+        except (psutil.Error, AttributeError, OSError, ValueError) as exc:
+            # either it has already exited, or the platform doesn't support it
+            log.debug('Unable to set the priority of process %d: %s', pid, exc)
+
+    def reason_to_defer(self, files, queued_at):
+        """Why a batch of files should be held back for now, or None if it should run."""
+        if len(files) <= self.config.urgent_max_files:
+            return None
+
+        if queued_at is not None and monotonic() - queued_at >= self.config.max_defer_seconds:
+            return None
+
+        return self.overloaded()
+
+    def overloaded(self):
+        """Why the machine is too busy for batches that aren't urgent, or None if it isn't."""
+        with self.lock:
+            now = monotonic()
+            if self.checked_at is None or now - self.checked_at >= LOAD_CHECK_SECONDS:
+                self.checked_at = now
+                self.overload = self._check_load()
+            return self.overload
+
+    def _check_load(self):
+        if self.config.max_load > 0:
+            load = os.getloadavg()[0] / self.cpus
+            if load > self.config.max_load:
+                return f'the load average is {load:.2f} per CPU (max_load {self.config.max_load})'
+
+        if self.config.max_linter_cpu > 0:
+            linter_cpu = self._children_cpu_percent() / self.cpus
+            if linter_cpu > self.config.max_linter_cpu:
+                return (
+                    f'linters are using {linter_cpu:.0f}% of the CPUs '
+                    f'(max_linter_cpu {self.config.max_linter_cpu})'
+                )
+
+        return None
+
+    def _children_cpu_percent(self):
+        children = {}
+        total = 0
+        try:
+            current_children = psutil.Process().children(recursive=True)
+        except psutil.Error:
+            return 0
+
+        for child in current_children:
+            # the first measurement of a process is always 0
+            child = self.children.get(child.pid, child)
+            try:
+                total += child.cpu_percent()
+            except psutil.Error:
+                continue
+            children[child.pid] = child
+
+        self.children = children
+        return total
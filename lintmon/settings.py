@@ -1,8 +1,81 @@
 import os
 
 CONFIG_FILE = 'lintmon.yaml'
-DEFAULT_IGNORED_DIRECTORY_NAMES = [r'\.lintmon', r'\.git', 'node_modules', '__pycache__']
+DEFAULT_IGNORED_DIRECTORY_NAMES = ['.lintmon', '.git', 'node_modules', '__pycache__']
 STATE_DIR = '.lintmon'
 PID_FILE = os.path.join(STATE_DIR, 'pid')
 STOP_WAIT_SECONDS = 10
 STOP_FILE = os.path.join(STATE_DIR, 'stop')
+CONFIG_CACHE_FILE = os.path.join(STATE_DIR, 'config_cache.json')
+BADGE_FILE = os.path.join(STATE_DIR, 'badge')
+IMPORT_GRAPH_FILE = os.path.join(STATE_DIR, 'import_graph.json')
+SOCKET_FILE = os.path.join(STATE_DIR, 'lintmond.sock')
+# with this set in the environment, one lintmond per user serves all of their projects (see
+# shared_daemon.py), keeping its own files here, rather than there being one per project
+SHARED_ENV_VAR = 'LINTMON_SHARED'
+SHARED_STATE_DIR = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache'), 'lintmon'
+)
+SHARED_SOCKET_FILE = os.path.join(SHARED_STATE_DIR, 'lintmond.sock')
+SHARED_PID_FILE = os.path.join(SHARED_STATE_DIR, 'pid')
+# how often the shared lintmond checks for projects that have been stopped or removed
+SHARED_CHECK_SECONDS = 10
+# how long lintmon-status-prompt waits for lintmond to answer before falling back to the badge
+# file, and how long other commands wait
+PROMPT_QUERY_TIMEOUT_SECONDS = 0.05
+QUERY_TIMEOUT_SECONDS = 2
+# how many events may wait to be written to a subscriber before it's dropped for not reading them
+SUBSCRIBER_MAX_EVENTS = 1000
+RESULT_CACHE_SIZE = 10000
+# the exit statuses of a monitor's command that mean it checked the files, whether or not it found
+# problems, as opposed to failing
+OK_EXIT_CODES = (0, 1)
+# how long to wait for file changes to stop before linting, and the most we'll delay linting by
+DEBOUNCE_SECONDS = 0.2
+MAX_DEBOUNCE_SECONDS = 2
+# how often the daemon checks whether running monitors have finished
+RUNNING_POLL_SECONDS = 0.1
+# limits on the files passed to each run of a monitor's command: the byte limit keeps us well within
+# the operating system's limit on the size of the command line
+CHUNK_MAX_BYTES = 128 * 1024
+CHUNK_MAX_FILES = 1000
+# don't split fewer files than this between processes
+CHUNK_MIN_FILES = 20
+# how many jobs a monitor's worker process runs before it is replaced with a fresh one
+WARM_WORKER_MAX_JOBS = 100
+WARM_WORKER_STOP_SECONDS = 1
+# the most problem lines kept from a monitor's output for each file, and in total, so that a
+# misbehaving command can't exhaust lintmond's memory
+MAX_PROBLEM_LINES_PER_FILE = 1000
+MAX_PROBLEM_LINES = 100000
+OUTPUT_MAX_LINE_LENGTH = 64 * 1024
+# when a monitor's config files change, all its files are checked again this many at a time, and
+# its badge is marked as out of date until they have been
+RELINT_CHUNK_FILES = 50
+RELINTING_MARK = '…'
+# how often the polling watcher checks for changes
+POLL_WATCHER_SECONDS = 1
+WATCHER_NAMES = ['auto', 'inotify', 'fswatch', 'poll']
+IO_PRIORITY_NAMES = ['normal', 'low', 'idle']
+SCOPE_NAMES = ['files', 'dependents']
+# how many imports away the files checked by a monitor with the dependents scope may be from a
+# changed file
+DEPENDENTS_DEPTH = 3
+DISCOVERY_NAMES = ['walk', 'git']
+# the timings of each run of a monitor are appended to the metrics file, which is rotated when it
+# gets too big, and lintmond keeps the most recent runs of each monitor for lintmon-stats
+METRICS_FILE = os.path.join(STATE_DIR, 'metrics.jsonl')
+METRICS_FILE_MAX_BYTES = 1024 * 1024
+METRICS_FILE_BACKUPS = 1
+METRICS_WINDOW = 1000
+# the priority linters are run at, and when lintmond holds back batches of files that aren't
+# urgent: when the load average per CPU, or our linters' share of all the CPUs (as a percentage),
+# is over these, for up to a limit
+NICE = 10
+IO_PRIORITY = 'low'
+MAX_LOAD = 1.0
+MAX_LINTER_CPU = 50
+URGENT_MAX_FILES = 10
+MAX_DEFER_SECONDS = 60
+# how often to check the load while batches are held back
+LOAD_CHECK_SECONDS = 1
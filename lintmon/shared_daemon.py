@@ -0,0 +1,219 @@
+"""One lintmond serving all of a user's projects.
+
+With LINTMON_SHARED set in the environment, the commands use a single `lintmond --shared` per
+user rather than a lintmond in each project. It registers a project the first time it's asked
+about it, each request saying which project it's about with its directory as `root`, and from
+then on watches it along with the others with a single watcher, running the monitors of all of
+them within one limit on the number of linter processes. Each project's state is still kept in
+its own .lintmon directory, so the commands that read it directly work as before.
+
+A project is dropped when it's stopped with lintmon-stop or its lintmon.yaml goes away.
+"""
+import logging
+import logging.handlers
+import os
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import sleep, time
+
+from .badge import config_mtime_ns
+from .config import BadConfig, default_concurrency, load_config_file
+from .lintmon import Lintmon
+from .query_server import QueryServer
+from .settings import (
+    CONFIG_FILE,
+    METRICS_FILE,
+    METRICS_FILE_BACKUPS,
+    METRICS_FILE_MAX_BYTES,
+    SHARED_CHECK_SECONDS,
+    SHARED_SOCKET_FILE,
+    STOP_FILE,
+)
+from .watchers import create_watcher
+
+
+log = logging.getLogger(__name__)
+
+
+class SharedDaemon:
+    def __init__(self, concurrency=None):
+        # root directory -> the Lintmon running the project, and the Event set once each of the
+        # projects being registered is
+        self.projects = {}
+        self.registering = {}
+        self.lock = Lock()
+        self.process_slots = BoundedSemaphore(
+            default_concurrency() if concurrency is None else concurrency
+        )
+        self.watcher = None
+        self.query_server = SharedQueryServer(self)
+
+    def run(self, roots=()):
+        # Doesn't return
+        self.query_server.start()
+        self.watcher = create_watcher(
+            'auto', self.path_changed, roots=[], known_files=self.known_files
+        )
+        self.watcher.start()
+        for root in roots:
+            self.project(root)
+
+        try:
+            while True:
+                sleep(SHARED_CHECK_SECONDS)
+                self.check_projects()
+        except BaseException as exc:
+            log.debug('Exiting due to exception %s', exc)
+            for root in list(self.projects):
+                self.unregister(root)
+            self.watcher.stop()
+            self.query_server.stop()
+            raise
+
+    def project(self, root):
+        """The project in the directory, registering it if need be, or None if it isn't one."""
+        root = os.path.realpath(root)
+        with self.lock:
+            if root in self.projects:
+                return self.projects[root]
+            registered_elsewhere = root in self.registering
+            if not registered_elsewhere:
+                self.registering[root] = Event()
+            registered = self.registering[root]
+
+        # starting a project takes a while, so other projects' requests aren't held up by it,
+        # while those about the same project wait for the thread registering it
+        if registered_elsewhere:
+            registered.wait()
+            return self.projects.get(root)
+
+        project = None
+        try:
+            project = self.register(root)
+        finally:
+            with self.lock:
+                if project is not None:
+                    self.projects[root] = project
+                del self.registering[root]
+            registered.set()
+        return project
+
+    def register(self, root):
+        if os.path.exists(os.path.join(root, STOP_FILE)):
+            return None
+
+        try:
+            config = load_config_file(os.path.join(root, CONFIG_FILE))
+        except BadConfig as exc:
+            log.info('Not registering %s: %s', root, exc)
+            return None
+
+        if config.watcher != 'auto':
+            log.warning(
+                'Watching %s with the auto watcher rather than %s, as for all projects',
+                root,
+                config.watcher,
+            )
+
+        log.info('Registering %s', root)
+        project = Lintmon(config, self.process_slots, metrics_log_for(root))
+        # answers the queries about the project that come to our socket
+        project.query_server = QueryServer(project, socket_file=None)
+        project.watcher = self.watcher
+        project.start()
+        self.watcher.add_root(root)
+        project.start_reconcile()
+        Thread(target=project.dispatch_main, name=f'dispatch-{root}', daemon=True).start()
+        return project
+
+    def unregister(self, root):
+        with self.lock:
+            project = self.projects.pop(root, None)
+        if project is None:
+            return False
+
+        log.info('Unregistering %s', root)
+        self.watcher.remove_root(root)
+        project.stop()
+        for handler in list(project.metrics_log.handlers):
+            project.metrics_log.removeHandler(handler)
+            handler.close()
+        return True
+
+    def check_projects(self):
+        # changes to a project's config are picked up by the project itself
+        for root in list(self.projects):
+            if config_mtime_ns(root) is None or os.path.exists(os.path.join(root, STOP_FILE)):
+                self.unregister(root)
+
+    def path_changed(self, path):
+        # called from the watcher's thread
+        project = self.project_for_path(path.strip())
+        if project is not None:
+            project.path_changed(path)
+
+    def known_files(self, directory):
+        project = self.project_for_path(directory)
+        return [] if project is None else project.known_files(directory)
+
+    def project_for_path(self, path):
+        # the innermost, should one project be inside another
+        roots = [r for r in list(self.projects) if path.startswith(os.path.join(r, ''))]
+        if len(roots) == 0:
+            return None
+        return self.projects.get(max(roots, key=len))
+
+
+def metrics_log_for(root):
+    """A logger for the metrics of a project, which writes them to its own metrics file."""
+    metrics_log = logging.getLogger(f'lintmon.metrics.{root.replace(".", "_")}')
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(root, METRICS_FILE),
+        maxBytes=METRICS_FILE_MAX_BYTES,
+        backupCount=METRICS_FILE_BACKUPS,
+        delay=True,
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_log.addHandler(handler)
+    metrics_log.setLevel(logging.INFO)
+    metrics_log.propagate = False
+    return metrics_log
+
+
+class SharedQueryServer(QueryServer):
+    """Passes each query on to the project it's about, besides a few about the daemon itself."""
+
+    DAEMON_QUERIES = {'ping', 'health', 'unregister'}
+
+    def __init__(self, daemon):
+        super().__init__(None, SHARED_SOCKET_FILE)
+        self.daemon = daemon
+
+    def server_for(self, request):
+        if 'root' not in request or request.get('query') == 'unregister':
+            return self
+
+        project = self.daemon.project(request.pop('root'))
+        return project and project.query_server
+
+    def answer(self, request):
+        if request.get('query') not in self.DAEMON_QUERIES:
+            return {'error': f'{request.get("query")!r} needs the root of a project'}
+        return super().answer(request)
+
+    def query_ping(self):
+        return {'pid': os.getpid(), 'shared': True}
+
+    def query_health(self):
+        watcher = self.daemon.watcher
+        return {
+            'pid': os.getpid(),
+            'uptime_seconds': time() - self.started_at,
+            'watcher': {
+                'name': type(watcher).__name__ if watcher is not None else None,
+                'alive': watcher is not None and watcher.thread.is_alive(),
+            },
+            'projects': sorted(self.daemon.projects),
+        }
+
+    def query_unregister(self, root):
+        return {'unregistered': self.daemon.unregister(os.path.realpath(root))}
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+from threading import Lock
+
+from .settings import STATE_DIR
+from .utils import write_file_atomic
+
+
+log = logging.getLogger(__name__)
+
+
+def stat_key(filepath):
+    """Return what we compare to tell if a file has changed, or None if it doesn't exist."""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+class StatIndex:
+    """The stat of every file as of when a monitor last checked it.
+
+    This lets us work out which files have changed since the monitor last ran, e.g. while
+    lintmond wasn't running. The index is kept as a log of updates, one JSON array per line, so
+    recording a few files doesn't mean rewriting the whole index; the log is compacted when it
+    is loaded if it has grown much larger than the index.
+
+    The first line of the log is the monitor's lint_key() when the files were checked. If that
+    has changed since, so has what checking them means, and the index is stale.
+    """
+
+    @classmethod
+    def for_monitor(cls, config):
+        return cls(
+            config.path(STATE_DIR, 'monitors', config.name, 'stat_index'),
+            config.root,
+            config.lint_key(),
+        )
+
+    def __init__(self, filepath, root='', lint_key=None):
+        self.filepath = filepath
+        # the directory the paths of the files are relative to
+        self.root = root
+        self.header = json.dumps({'lint_key': lint_key})
+        self.entries = None
+        # whether the log on disk was written for a different lint_key
+        self.stale = False
+        # whether the log needs starting afresh, with the header, before recording to it
+        self.needs_header = True
+        self.lock = Lock()
+
+    def is_stale(self):
+        """Whether the files were checked with a different lint_key(), so all need checking."""
+        with self.lock:
+            self._ensure_loaded()
+            return self.stale
+
+    def changed_files(self, files):
+        """Return those of the files, and of the files we've seen before, that have changed."""
+        with self.lock:
+            self._ensure_loaded()
+            current_files = dict.fromkeys(files)
+            changed_files = [
+                f
+                for f in current_files
+                if self.entries.get(f) != stat_key(os.path.join(self.root, f))
+            ]
+            deleted_files = [
+                f
+                for f in self.entries
+                if f not in current_files and not os.path.exists(os.path.join(self.root, f))
+            ]
+
+        return changed_files + deleted_files
+
+    def files_under(self, directory):
+        """Return the files we've seen in the directory or its subdirectories."""
+        prefix = os.path.join(directory, '')
+        with self.lock:
+            self._ensure_loaded()
+            return [f for f in self.entries if f.startswith(prefix)]
+
+    def record(self, file_stats):
+        """Record the stats of files, as taken before they were checked."""
+        if len(file_stats) == 0:
+            return
+
+        with self.lock:
+            self._ensure_loaded()
+            lines = []
+            for file, key in file_stats.items():
+                if key is None:
+                    self.entries.pop(file, None)
+                    lines.append(json.dumps([file]))
+                else:
+                    self.entries[file] = key
+                    lines.append(json.dumps([file, *key]))
+
+            mode = 'a'
+            if self.needs_header:
+                lines.insert(0, self.header)
+                mode = 'w'
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            with open(self.filepath, mode) as file:
+                file.write(''.join(f'{line}\n' for line in lines))
+            self.needs_header = False
+
+    def _ensure_loaded(self):
+        if self.entries is not None:
+            return
+
+        self.entries = {}
+        num_lines = 0
+        try:
+            with open(self.filepath) as file:
+                if file.readline().rstrip('\n') != self.header:
+                    # written for another lint_key, or before they were recorded
+                    log.debug('%s is stale', self.filepath)
+                    self.stale = True
+                    return
+                self.needs_header = False
+                for line in file:
+                    num_lines += 1
+                    try:
+                        path, *key = json.loads(line)
+                    except ValueError:
+                        # e.g. a partial last line if we were killed while writing
+                        continue
+                    if len(key) == 0:
+                        self.entries.pop(path, None)
+                    else:
+                        self.entries[path] = key
+        except FileNotFoundError:
+            return
+
+        if num_lines > 2 * len(self.entries) + 1000:
+            log.debug('Compacting %s', self.filepath)
+            write_file_atomic(
+                self.filepath,
+                ''.join(
+                    [f'{self.header}\n']
+                    + [f'{json.dumps([path, *key])}\n' for path, key in self.entries.items()]
+                ),
+            )
@@ -1,3 +1,10 @@
+import os
+
+# the umask can only be read by setting it, which is not thread safe, so read it once on import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
 def colour_text(text, foreground='white', background='black'):
     foreground_colours = {
         'black': '30',
@@ -60,3 +67,32 @@ def gb(iter_, func):
 
 def lf(func, iter_):
     return list(filter(func, iter_))
+
+
+def write_file_atomic(filepath, text):
+    # write to a temporary file alongside the target and rename over it so that readers never
+    # see a partially written file
+    import tempfile  # not at module level: slow to import and not needed by the prompt
+
+    dirpath = os.path.dirname(filepath) or os.curdir
+    os.makedirs(dirpath, exist_ok=True)
+    fd, tmp_filepath = tempfile.mkstemp(dir=dirpath, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(text)
+        # mkstemp creates the file readable only by us: give it the mode open() would have
+        os.chmod(tmp_filepath, 0o666 & ~_UMASK)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+
+
+def file_digest(filepath):
+    import hashlib  # not at module level: not needed by the prompt
+
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
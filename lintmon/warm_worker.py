@@ -0,0 +1,190 @@
+"""Long-lived worker processes that check files on request.
+
+Starting a linter written in Python typically costs far more than linting a handful of files, so
+a monitor can instead be configured with a worker, which is started once and then sent each batch
+of files to check.
+
+The protocol is line based. For each job lintmond writes a JSON array of file paths on a line of
+the worker's stdin, and the worker replies with a line on its stdout of a JSON object with the
+lines of output from checking them (`output`) and an exit code (`returncode`). The worker should
+exit when its stdin is closed.
+
+Run as a module this is the bundled worker, which imports a console script such as flake8 or
+black once and runs its entry point in-process for each job:
+
+    python -m lintmon.warm_worker flake8 --max-line-length 100
+"""
+import io
+import json
+import logging
+import os
+import sys
+from subprocess import PIPE, Popen, TimeoutExpired
+from threading import RLock
+
+from .settings import WARM_WORKER_STOP_SECONDS
+
+
+log = logging.getLogger(__name__)
+
+# what the bundled worker reports when the linter raises an exception, as EX_SOFTWARE in sysexits.h
+CRASHED_RETURNCODE = 70
+
+
+class WarmWorkerError(Exception):
+    pass
+
+
+class WarmWorker:
+    """lintmond's side of a monitor's worker process, which it (re)starts as necessary."""
+
+    @classmethod
+    def for_monitor(cls, config, on_start=None):
+        if config.worker is True:
+            command = [sys.executable, '-m', __name__, *config.command]
+        else:
+            command = config.worker
+        return cls(command, config.worker_max_jobs, on_start, cwd=config.root or None)
+
+    def __init__(self, command, max_jobs, on_start=None, cwd=None):
+        self.command = command
+        self.max_jobs = max_jobs
+        self.cwd = cwd
+        # called with the pid of each worker process started, e.g. to lower its priority
+        self.on_start = on_start
+        self.process = None
+        self.jobs = 0
+        # jobs are run on the sessions' threads, one at a time, and may be interrupted from others
+        self.lock = RLock()
+        self.interrupted = False
+
+    def run(self, files):
+        """Check the files, returning the output lines and the exit code."""
+        with self.lock:
+            self.interrupted = False
+            # if the worker has crashed, say because it was killed, give it a second chance
+            for _ in range(2):
+                self._ensure_started()
+                try:
+                    self.process.stdin.write(json.dumps(files) + '\n')
+                    self.process.stdin.flush()
+                    response = self.process.stdout.readline()
+                    result = json.loads(response)
+                    output = result['output']
+                    returncode = result['returncode']
+                    if not isinstance(returncode, int):
+                        raise TypeError(f'returncode {returncode!r} is not an integer')
+                except (OSError, ValueError, KeyError, TypeError) as exc:
+                    self.stop()
+                    if self.interrupted:
+                        raise WarmWorkerError(f'Worker {" ".join(self.command)} interrupted')
+                    log.warning('Worker %s failed (%s), restarting', self.command, exc)
+                    continue
+
+                self.jobs += 1
+                if self.jobs >= self.max_jobs:
+                    log.debug('Recycling worker %s after %d jobs', self.command, self.jobs)
+                    self.stop()
+
+                return output, returncode
+
+        raise WarmWorkerError(f'Worker {" ".join(self.command)} keeps failing')
+
+    def interrupt(self):
+        """Kill the worker in the middle of a job, whose results are no longer wanted."""
+        self.interrupted = True
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def stop(self):
+        with self.lock:
+            if self.process is None:
+                return
+
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=WARM_WORKER_STOP_SECONDS)
+            except (OSError, TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def _ensure_started(self):
+        if self.process is not None and self.process.poll() is None:
+            return
+
+        log.info('Starting worker %s', self.command)
+        self.jobs = 0
+        try:
+            self.process = Popen(
+                self.command, stdin=PIPE, stdout=PIPE, encoding='utf8', bufsize=1, cwd=self.cwd
+            )
+        except OSError as exc:
+            self.process = None
+            raise WarmWorkerError(str(exc).replace('\n', ' ')) from exc
+
+        if self.on_start is not None:
+            self.on_start(self.process.pid)
+
+
+# --------------------------------------------------------------------------------------------------
+# Bundled worker
+# --------------------------------------------------------------------------------------------------
+def main():
+    command = sys.argv[1:]
+    if len(command) == 0:
+        sys.exit(f'usage: {sys.executable} -m lintmon.warm_worker COMMAND [ARGS...]')
+
+    entry_point = load_console_script(command[0])
+
+    # keep stdout for the protocol, and send anything written directly to file descriptor 1 (say
+    # by a subprocess) to stderr instead
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in sys.stdin:
+        output, returncode = run_in_process(entry_point, [*command, *json.loads(line)])
+        print(json.dumps({'output': output, 'returncode': returncode}), file=protocol_out)
+        protocol_out.flush()
+
+
+def load_console_script(name):
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        candidates = list(eps.select(group='console_scripts', name=name))
+    else:
+        # python < 3.10
+        candidates = [ep for ep in eps.get('console_scripts', []) if ep.name == name]
+
+    if len(candidates) == 0:
+        sys.exit(f'No console script {name!r} is installed in {sys.prefix}')
+
+    return candidates[0].load()
+
+
+def run_in_process(entry_point, argv):
+    # linters write to sys.stdout/sys.stderr or their binary buffers, so capture both in a real
+    # text stream rather than a StringIO
+    captured = io.TextIOWrapper(io.BytesIO(), encoding='utf8', write_through=True)
+    saved_argv, saved_stdout, saved_stderr = sys.argv, sys.stdout, sys.stderr
+    sys.argv, sys.stdout, sys.stderr = argv, captured, captured
+    try:
+        returncode = entry_point() or 0
+    except SystemExit as exc:
+        returncode = exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+    except Exception as exc:
+        print(f'{argv[0]} raised {exc!r}', file=captured)
+        # not 1, which linters use to say they found problems
+        returncode = CRASHED_RETURNCODE
+    finally:
+        sys.argv, sys.stdout, sys.stderr = saved_argv, saved_stdout, saved_stderr
+
+    captured.flush()
+    return captured.buffer.getvalue().decode('utf8', 'replace').splitlines(), returncode
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""Backends watching the project directory for changed files.
+
+Each watcher calls its callback with the path of every file that may have changed (including
+files that have been deleted) from a thread of its own, and if it fails irrecoverably it
+terminates lintmond, as there's no point in it running without being told about changes. The
+files in a directory that has been moved away can't be listed, so a watcher may instead be given
+a function returning the files lintmond knows of under a path.
+
+A watcher may watch several directories, which the shared lintmond adds and removes as projects
+come and go, in which case the paths are in whichever of the directories the file is in.
+"""
+import atexit
+import logging
+import os
+import re
+import select
+import shutil
+import struct
+import sys
+from signal import SIGTERM
+from subprocess import PIPE, Popen
+from threading import Event, Thread
+from time import time
+
+from .discovery import walk_project
+from .settings import DEFAULT_IGNORED_DIRECTORY_NAMES, POLL_WATCHER_SECONDS
+
+
+log = logging.getLogger(__name__)
+
+
+def create_watcher(name, on_path, roots=None, known_files=None):
+    if name == 'auto':
+        if InotifyWatcher.is_available():
+            name = 'inotify'
+        elif FswatchWatcher.is_available():
+            name = 'fswatch'
+        else:
+            name = 'poll'
+
+    log.info('Using %s watcher', name)
+    return WATCHERS[name](on_path, roots, known_files)
+
+
+class Watcher:
+    def __init__(self, on_path, roots=None, known_files=None):
+        self.on_path = on_path
+        self.known_files = known_files
+        self.roots = [os.curdir] if roots is None else list(roots)
+        self.thread = None
+        self.stopped = Event()
+
+    def add_root(self, root):
+        self.roots.append(root)
+
+    def remove_root(self, root):
+        self.roots.remove(root)
+
+    def start(self):
+        # non-daemon thread doesn't need to be joined or terminated: will exit when main thread
+        # exits
+        self.thread = Thread(target=self.main, name=f'{type(self).__name__}')
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def main(self):
+        try:
+            self.watch()
+        except Exception:
+            log.exception('%s failed', type(self).__name__)
+
+        if not self.stopped.is_set():
+            log.debug('%s finished, killing self', type(self).__name__)
+            os.kill(os.getpid(), SIGTERM)
+
+    def watch(self):
+        raise NotImplementedError
+
+
+class FswatchWatcher(Watcher):
+    @staticmethod
+    def is_available():
+        return shutil.which('fswatch') is not None
+
+    def __init__(self, on_path, roots=None, known_files=None):
+        super().__init__(on_path, roots, known_files)
+        self.fswatch = None
+
+    def start(self):
+        self.restart_fswatch()
+        atexit.register(self.terminate_fswatch)
+        super().start()
+
+    def stop(self):
+        log.debug('Stopping fswatch')
+        super().stop()
+        self.terminate_fswatch()
+
+    def add_root(self, root):
+        super().add_root(root)
+        if self.thread is not None:
+            self.restart_fswatch()
+
+    def remove_root(self, root):
+        super().remove_root(root)
+        if self.thread is not None:
+            self.restart_fswatch()
+
+    def restart_fswatch(self):
+        # fswatch can't be told about more paths once started, so it's replaced by one watching
+        # all of them, or none at all
+        previous = self.fswatch
+        self.fswatch = None
+        if len(self.roots) > 0:
+            excluded_dir_paths_options = [
+                arg
+                for dirpattern in (
+                    f'{re.escape(dname)}/' for dname in DEFAULT_IGNORED_DIRECTORY_NAMES
+                )
+                for arg in ['--exclude', dirpattern]
+            ]
+
+            args = ['fswatch', '--extended', *excluded_dir_paths_options, *self.roots]
+            log.info('Starting fswatch')
+            log.debug('Args: %s', args)
+            self.fswatch = Popen(args, stdout=PIPE, stderr=PIPE, encoding='utf8',)
+        if previous is not None:
+            previous.terminate()
+
+    def terminate_fswatch(self):
+        if self.fswatch is not None:
+            self.fswatch.terminate()
+
+    def watch(self):
+        while not self.stopped.is_set():
+            fswatch = self.fswatch
+            if fswatch is None:
+                self.stopped.wait(POLL_WATCHER_SECONDS)
+                continue
+
+            for line in fswatch.stdout:
+                self.on_path(line)
+            if fswatch is self.fswatch:
+                # it wasn't replaced, so it has exited of its own accord
+                return
+
+
+class PollingWatcher(Watcher):
+    """Finds changes by comparing the size and mtime of every file periodically."""
+
+    def watch(self):
+        # the first snapshot of each directory is what later ones are compared to
+        snapshots = {}
+        while True:
+            roots = list(self.roots)
+            for root in roots:
+                new_snapshot = self.snapshot(root)
+                snapshot = snapshots.get(root)
+                if snapshot is not None:
+                    for path in snapshot.keys() | new_snapshot.keys():
+                        if snapshot.get(path) != new_snapshot.get(path):
+                            self.on_path(path)
+                snapshots[root] = new_snapshot
+            snapshots = {root: snapshots[root] for root in roots}
+
+            if self.stopped.wait(POLL_WATCHER_SECONDS):
+                return
+
+    @staticmethod
+    def snapshot(root):
+        snapshot = {}
+        for dirpath, _, files in walk_project(root):
+            for file in files:
+                path = os.path.join(dirpath, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+
+class InotifyWatcher(Watcher):
+    """Linux's inotify API, used directly through ctypes.
+
+    Every directory in the project apart from the ignored ones is watched, and directories are
+    watched or forgotten as they come and go. If the kernel's event queue overflows and events
+    are lost, the tree is rescanned for files modified since we last read events.
+    """
+
+    # from <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    WATCH_MASK = (
+        IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+    EVENT_HEADER = struct.Struct('iIII')
+    READ_SIZE = 64 * 1024
+    # allow for filesystems with coarse mtimes when rescanning after an overflow
+    RESCAN_SLACK_SECONDS = 2
+
+    @classmethod
+    def is_available(cls):
+        return cls._libc() is not None
+
+    @staticmethod
+    def _libc():
+        if not sys.platform.startswith('linux'):
+            return None
+
+        import ctypes
+        import ctypes.util
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        except OSError:
+            return None
+
+        if not hasattr(libc, 'inotify_init1'):
+            return None
+
+        return libc
+
+    def __init__(self, on_path, roots=None, known_files=None):
+        super().__init__(on_path, roots, known_files)
+        self.libc = self._libc()
+        self.fd = None
+        # watch descriptor -> directory path, and the reverse
+        self.watched_dirs = {}
+        self.watch_descriptors = {}
+        self.last_read_time = time()
+
+    def start(self):
+        import ctypes
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_init1 failed: {os.strerror(errno)}')
+
+        log.info('Starting inotify')
+        for root in self.roots:
+            self.add_watches(root)
+        super().start()
+
+    def add_root(self, root):
+        super().add_root(root)
+        if self.fd is not None:
+            self.add_watches(root)
+
+    def remove_root(self, root):
+        super().remove_root(root)
+        if self.fd is not None:
+            self.forget_tree(root)
+
+    def watch(self):
+        try:
+            while not self.stopped.is_set():
+                readable, _, _ = select.select([self.fd], [], [], POLL_WATCHER_SECONDS)
+                if not readable:
+                    continue
+
+                read_time = time()
+                self.handle_events(os.read(self.fd, self.READ_SIZE))
+                self.last_read_time = read_time
+        finally:
+            os.close(self.fd)
+
+    def handle_events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name_end = offset + name_len
+            name = os.fsdecode(data[offset:name_end].rstrip(b'\0'))
+            offset = name_end
+
+            if mask & self.IN_Q_OVERFLOW:
+                log.warning('inotify queue overflowed, rescanning')
+                self.rescan(since=self.last_read_time - self.RESCAN_SLACK_SECONDS)
+                continue
+
+            if mask & self.IN_IGNORED:
+                # the watch was removed, because the directory was deleted or moved away
+                self.forget_watch(wd)
+                continue
+
+            dirpath = self.watched_dirs.get(wd)
+            if dirpath is None or mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                continue
+
+            path = os.path.join(dirpath, name)
+            if mask & self.IN_ISDIR:
+                if name in DEFAULT_IGNORED_DIRECTORY_NAMES:
+                    continue
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # files may have appeared in the directory before we started watching it
+                    self.add_watches(path, report_files=True)
+                elif mask & self.IN_MOVED_FROM:
+                    # as far as the project is concerned the files in it have been deleted
+                    if self.known_files is not None:
+                        for file in self.known_files(path):
+                            self.on_path(file)
+                    self.forget_tree(path)
+                continue
+
+            if mask & self.IN_CREATE:
+                # wait for the file to be closed, which also tells us about empty files
+                continue
+
+            self.on_path(path)
+
+    def add_watches(self, top, report_files=False):
+        for dirpath, _, files in walk_project(top):
+            self.add_watch(dirpath)
+            if report_files:
+                for file in files:
+                    self.on_path(os.path.join(dirpath, file))
+
+    def add_watch(self, dirpath):
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            log.warning(
+                'Unable to watch %s: %s%s',
+                dirpath,
+                os.strerror(errno),
+                ' (see fs.inotify.max_user_watches)' if errno == 28 else '',
+            )
+            return
+
+        self.watched_dirs[wd] = dirpath
+        self.watch_descriptors[dirpath] = wd
+
+    def forget_watch(self, wd):
+        dirpath = self.watched_dirs.pop(wd, None)
+        if dirpath is not None and self.watch_descriptors.get(dirpath) == wd:
+            del self.watch_descriptors[dirpath]
+
+    def forget_tree(self, top):
+        # the directory has moved out from under its path, so stop watching it and its subdirs
+        prefix = os.path.join(top, '')
+        for dirpath, wd in list(self.watch_descriptors.items()):
+            if dirpath == top or dirpath.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.forget_watch(wd)
+
+    def rescan(self, since):
+        for dirpath, _, files in (d for root in list(self.roots) for d in walk_project(root)):
+            if dirpath not in self.watch_descriptors:
+                self.add_watch(dirpath)
+
+            for file in files:
+                path = os.path.join(dirpath, file)
+                try:
+                    modified = os.stat(path).st_mtime >= since
+                except OSError:
+                    continue
+                if modified:
+                    self.on_path(path)
+
+
+WATCHERS = {
+    'fswatch': FswatchWatcher,
+    'inotify': InotifyWatcher,
+    'poll': PollingWatcher,
+}